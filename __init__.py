@@ -11,12 +11,19 @@ bl_info = {
 import bpy 
 import os 
 import code
+import cProfile
+import json
 import bmesh
 import re
 import mathutils
-from .functions import apply_modifiers_with_shape_keys, ShapeKeyToReferenceKey
+from .functions import apply_modifiers_with_shape_keys, apply_shape_keys_to_reference_key, triangulate_object, vertex_weight_cache, ShapeKeyToReferenceKey
+from . import cache, estimate, stats, widget
+from .gltf import write_gltf
+from .mdl import write_mdl
+from .split import split_oversize_submeshes
+from .staging import stage_export_objects, remove_staging_scene, export_datablocks
 from .widget import BlfText, draw_widget, subscribe, unsubscribe
-from bpy.props import StringProperty, BoolProperty, EnumProperty 
+from bpy.props import StringProperty, BoolProperty, EnumProperty, FloatProperty 
 from bpy_extras.io_utils import ImportHelper, ExportHelper 
 from bpy.types import Operator 
 
@@ -25,6 +32,7 @@ from bpy.types import Operator
 class ShapekeyCounter(Operator):
     bl_idname = "ffxiv_tools.shape_count"
     bl_label = "FFXIV Shapekeys"
+    bl_options = {'REGISTER'}
 
     enabled : BoolProperty(
         name="Enable or Disable",
@@ -32,14 +40,11 @@ class ShapekeyCounter(Operator):
         default=False,
     )
 
-    def draw(self, context):
-        layout = self.layout
-        overlay = context.space_data.overlay
-        layout.prop(overlay, "enabled", text="FF14 Shapekey Counter", toggle=True)
-
     def execute(self, context):
         global text_handle
+        update_shapekey_counter(context.window_manager, context)
         if not self.enabled:
+            widget.invalidate()
             text_handle = bpy.types.SpaceView3D.draw_handler_add(draw_widget, (), 'WINDOW', 'POST_PIXEL')
             subscribe()
             self.enabled = not self.enabled
@@ -96,10 +101,11 @@ class ExportFile(Operator, ExportHelper):
             ('.fbx', '.fbx file', "fbx for exporting to Textools"),
             ('.gltf', '.gltf file', "gltf for exporting to Penumbra"),
             ('.glb', '.glb file', "glb for exporting to Penumbra"),
+            ('.mdl', '.mdl file', "mdl for the game, written directly without another tool"),
         )
     
     filter_glob: StringProperty(
-        default='*.glb;*.gltf;*.fbx',
+        default='*.glb;*.gltf;*.fbx;*.mdl',
         options={'HIDDEN'} 
     )
     
@@ -141,6 +147,43 @@ class ExportFile(Operator, ExportHelper):
      
         
     
+    use_cache: BoolProperty(
+        name="Reuse Unchanged Meshes",
+        description="Skip the shapekey fixes and tangents for meshes that haven't changed since the last export",
+        default=True,
+    )
+    use_native_gltf: BoolProperty(
+        name="Native Writer",
+        description="Write the glTF directly instead of through Blender's glTF exporter, only what Penumbra reads is written",
+        default=False,
+    )
+    triangulate: BoolProperty(
+        name="Triangulate",
+        description="Triangulate the meshes once before exporting, the result is reused with Reuse Unchanged Meshes",
+        default=True,
+    )
+    split_submeshes: BoolProperty(
+        name="Split Oversize Submeshes",
+        description="Split submeshes over the 65535 vertex limit into more meshes instead of only warning about them",
+        default=True,
+    )
+    write_report: BoolProperty(
+        name="Write Report",
+        description="Write the time spent in each export stage and what was done to a .report.json next to the exported file, or the estimate to a .estimate.json",
+        default=False,
+    )
+    use_profile: BoolProperty(
+        name="Profile",
+        description="Write a cProfile dump of the export to a .prof next to the exported file",
+        default=False,
+    )
+    dry_run: BoolProperty(
+        name="Estimate Only",
+        description="Report what the export would do to each mesh and how long it would take, without exporting anything",
+        default=False,
+    )
+        
+    
     some_boolean: BoolProperty( 
         name='Do a thing',
         description='Do a thing with the file you\'ve selected',
@@ -161,18 +204,55 @@ class ExportFile(Operator, ExportHelper):
 
         
     def execute(self, context):
+        if self.dry_run:
+            return self.run_estimate(context)
+
+        with stats.recording(trace_memory=self.write_report or self.use_profile) as export_stats:
+            #everything the export makes is removed afterwards, whether it finished or not
+            with export_datablocks() as datablocks:
+                if self.use_profile:
+                    profiler = cProfile.Profile()
+                    result = profiler.runcall(self.run_export, context)
+                    profiler.dump_stats(os.path.splitext(self.filepath)[0] + ".prof")
+                else:
+                    result = self.run_export(context)
+
+        leaked = {name: count for name, count in datablocks["leaked"].items() if count}
+        if leaked:
+            self.report({'WARNING'}, "The export left datablocks behind: {leaked}".format(leaked=leaked))
+        if result == {'FINISHED'}:
+            self.report({'INFO'}, export_stats.summary())
+            if self.write_report:
+                export_stats.write(os.path.splitext(self.filepath)[0] + ".report.json")
+        return result
+
+    def export_objects(self, context):
+        if self.use_visible:
+            return context.visible_objects
+        elif self.use_selection:
+            return context.selected_objects
+        return context.scene.objects
+
+    def run_estimate(self, context):
+        #only reads the originals, nothing is staged or changed
+        meshes = [o for o in self.export_objects(context) if o.type == 'MESH']
+        plan = plan_shapekey_fixes(meshes) if self.apply_modifiers == 'YES_PRESERVE' else []
+        result = estimate.estimate_export(meshes, plan, use_cache=self.use_cache, triangulate=self.triangulate)
+        estimate.print_estimate(result)
+        self.report({'INFO'}, estimate.summary(result))
+        if self.write_report:
+            with open(os.path.splitext(self.filepath)[0] + ".estimate.json", 'w') as f:
+                json.dump(result, f, indent=2)
+        return {'FINISHED'}
+
+    def run_export(self, context):
         """Do something with the selected file(s)."""
 
         active = bpy.context.active_object
         selected = bpy.context.selected_objects
 
         #print(self.apply_modifiers)     
-        if self.use_visible:
-            objects = context.visible_objects
-        elif self.use_selection:
-            objects = context.selected_objects
-        else:
-            objects = context.scene.objects
+        objects = self.export_objects(context)
 
 
         currentview = context.mode
@@ -181,106 +261,58 @@ class ExportFile(Operator, ExportHelper):
         dupes = []
         
 
-        tempcontext = bpy.context.copy()
         if(currentview != 'OBJECT'):
             bpy.ops.object.mode_set(mode='OBJECT')
 
-        for o in(o for o in objects if o.type == 'MESH'):
-            with context.temp_override(context=tempcontext):
-                
-                if context.selected_objects != []:
-                    bpy.ops.object.select_all(action="DESELECT")
-                context.view_layer.objects.active = o
-                o.select_set(state=True)
-                bpy.ops.object.duplicate()
-                dupe = context.active_object
-                dupe.name = "Export " + o.name
-                dupes.append(dupe)
-          #      if not mod.object.visible_get():
-        
-        armatures = []
-        for o in dupes:
-            for mod in (mod for mod in o.modifiers if mod.type == 'ARMATURE'):
-                if mod.show_viewport and not any(x == mod.object for x in armatures):
-                    armatures.append(mod.object)
+        #we need to duplicate every mesh so when we do all of our modifications we dont touch the originals
+        #the copies go in their own scene so only they are evaluated during the export
+        with stats.stage("staging"):
+            scene, dupes = stage_export_objects(context, objects)
         #halts if a mesh doesnt have an armature modifier
-        if None in armatures:
+        if scene is None:
             self.report({'ERROR'}, "One or more meshes with an amature modifier doesn't have an associated armature, please add the armature or remove the modifier.")
-            for o in dupes:
-                bpy.data.objects.remove(o)
             return {'CANCELLED'}
 
-        armatures_export = []
-        changed = None
-
-
-        if(len(armatures) > 0):
-            for arm in armatures:
-                with context.temp_override(context=tempcontext):
-                    
-                    
-                    arm_hidden = arm.hide_get()
-                    if arm_hidden:
-                        arm.hide_set(False)
-
-                    
-                    #if this is true then the collection should not be in the view layer
-                    if arm.hide_get() == arm.visible_get():
-                        coll = arm.users_collection[0]
-                        for lay in (lay for lay in context.scene.view_layers[0].layer_collection.children if lay.collection.user_of_id(arm.users_collection[0]) > 0):
-                            index = lay.children.find(arm.users_collection[0].name)
-                            if index != -1:
-                                changed = lay.children[index]
-                                lay.children[index].exclude = False
-                            else:
-                                for layer in (layer for layer in lay.children if layer.collection.user_of_id(arm.users_collection[0]) > 0):
-                                    index = lay.children.find(arm.users_collection[0].name)
-                                    if index != -1:
-                                        changed = lay.children[index]
-                                        lay.children[index].exclude = False
-
-
-
-                
-                if context.selected_objects != []:
-                    bpy.ops.object.select_all(action="DESELECT")
-                #code.interact(local=locals())
-                context.view_layer.objects.active = arm
-                arm.select_set(state=True)
-                bpy.ops.object.duplicate()
-                dupe = context.active_object
-                dupe.name = "Export " + arm.name
-                dupes.append(dupe)
-                armatures_export.append(dupe)
-
-                if arm_hidden:
-                    arm.hide_set(True)
-
-
-
-        
-        for o in (o for o in dupes if o.type == 'MESH'):
-            for mod in (mod for mod in o.modifiers if mod.type == 'ARMATURE'):
-                if mod.show_viewport and not any(x == mod.object for x in armatures_export):
-                    for arm in armatures_export:                      
-                        if arm.name.endswith(mod.object.name):                        
-                            mod.object = arm
-        
-
-
+        stats.count("objects_staged", len(dupes))
+        view_layer = scene.view_layers[0]
+        for ob in dupes:
+            ob.select_set(True, view_layer=view_layer)
 
         override = context.copy()
+        override["scene"] = scene
+        override["view_layer"] = view_layer
+        override["collection"] = scene.collection
         override["selected_objects"] = dupes
         override["active_object"] = dupes[0]
         with bpy.context.temp_override(**override):
 
             bpy.ops.object.mode_set(mode = 'OBJECT')
-            #we need to duplicate every mesh so when we do all of our modifications we dont touch the originals
-
 
 
             if self.apply_modifiers == 'YES_PRESERVE' and len(context.scene.objects) > 0:
-                shapekey_fixes(self, context, dupes)
+                #weights don't change during the fixes, so each mesh only has its weights read once
+                with vertex_weight_cache(), stats.stage("shapekey_fixes"):
+                    shapekey_fixes(self, context, dupes)
+
+            #meshes shapekey_fixes already triangulated (or got from the cache) are skipped
+            if self.triangulate:
+                with stats.stage("triangulate"):
+                    for ob in dupes:
+                        if ob.type == 'MESH':
+                            triangulate_object(ob)
+
+        #the pieces of split objects replace them, so the override is rebuilt with them
+        if self.split_submeshes:
+            with stats.stage("split"):
+                dupes = split_oversize_submeshes(dupes, widget.settings["epsilon"], widget.settings["union"])
+            for ob in dupes:
+                ob.select_set(True, view_layer=view_layer)
+            override["selected_objects"] = dupes
+            override["active_object"] = dupes[0]
+        with bpy.context.temp_override(**override):
+
+            with stats.stage("vertex_limits"):
+                check_vertex_limits(self, dupes)
 
 
 
@@ -291,34 +323,56 @@ class ExportFile(Operator, ExportHelper):
         
 
         #filename, extension = os.path.splitext(self.filepath)
-            match self.filename_ext:
-                case ".fbx":
-                    bpy.ops.export_scene.fbx(filepath = self.filepath,
-                                            primary_bone_axis='X',
-                                            secondary_bone_axis='Y',
-                                            #use_active_collection = self.use_active_collection,
-                                            #use_visible = self.use_visible,
-                                            use_selection = True,
-                                            use_mesh_modifiers = False if self.apply_modifiers == 'NO' else True,
-                                            use_custom_props = True,
-                                            add_leaf_bones = False,
-                                            bake_anim = False,
-                                            )
-                case ".glb" | ".gltf": 
-                    #experemental gltf fix
-                    #parent_meshes(self, context, dupes)
-                    bpy.ops.export_scene.gltf(filepath = self.filepath,
-                                            export_format= 'GLB' if self.filename_ext == '.glb' else 'GLTF_SEPARATE',
-                                            export_tangents=True,
-                                            use_selection = True,
-                                            export_try_sparse_sk = False,
-                                            export_apply = False if self.apply_modifiers == 'NO' else True,
-                                            export_animations = False,
-                                            )
+            result = {'FINISHED'}
+            with stats.stage("exporter"):
+                match self.filename_ext:
+                    case ".fbx":
+                        bpy.ops.export_scene.fbx(filepath = self.filepath,
+                                                primary_bone_axis='X',
+                                                secondary_bone_axis='Y',
+                                                #use_active_collection = self.use_active_collection,
+                                                #use_visible = self.use_visible,
+                                                use_selection = True,
+                                                use_mesh_modifiers = False if self.apply_modifiers == 'NO' else True,
+                                                use_custom_props = True,
+                                                add_leaf_bones = False,
+                                                bake_anim = False,
+                                                )
+                    case ".glb" | ".gltf": 
+                        #experemental gltf fix
+                        #parent_meshes(self, context, dupes)
+                        if self.use_native_gltf:
+                            write_gltf(context, self.filepath, dupes,
+                                       binary=self.filename_ext == '.glb',
+                                       apply_modifiers=self.apply_modifiers != 'NO',
+                                       use_cache=self.use_cache,
+                                       export_extras=self.gltf_props)
+                        else:
+                            bpy.ops.export_scene.gltf(filepath = self.filepath,
+                                                    export_format= 'GLB' if self.filename_ext == '.glb' else 'GLTF_SEPARATE',
+                                                    export_tangents=True,
+                                                    export_extras = self.gltf_props,
+                                                    use_selection = True,
+                                                    #only the staging scene, not the user's next to it
+                                                    use_active_scene = True,
+                                                    export_try_sparse_sk = False,
+                                                    export_apply = False if self.apply_modifiers == 'NO' else True,
+                                                    export_animations = False,
+                                                    )
+                    case ".mdl":
+                        try:
+                            write_mdl(context, self.filepath, dupes,
+                                      apply_modifiers=self.apply_modifiers != 'NO',
+                                      use_cache=self.use_cache)
+                        except ValueError as e:
+                            #over the game's limits, nothing was written
+                            self.report({'ERROR'}, str(e))
+                            result = {'CANCELLED'}
+            stats.count("output_bytes", output_size(self.filepath))
             #code.interact(local=locals())
         
-        for o in dupes:
-            bpy.data.objects.remove(o)
+        with stats.stage("cleanup"):
+            remove_staging_scene()
         if(active != None):
             bpy.context.view_layer.objects.active = active
         else:
@@ -326,14 +380,24 @@ class ExportFile(Operator, ExportHelper):
         bpy.ops.object.mode_set(mode=currentview)
         if(active == None):
             bpy.context.view_layer.objects.active = None
-        if changed != None:
-            changed.exclude = True
-        return {'FINISHED'} 
+        return result
+
+def output_size(filepath):
+    #gltf separate also writes a .bin next to the .gltf
+    paths = [filepath, os.path.splitext(filepath)[0] + ".bin"] if filepath.endswith(".gltf") else [filepath]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
 
 def export_main(layout, operator, is_file_browser):
     row = layout.row(align=True)
     row.prop(operator, "filename_ext")
     layout.prop(operator, "apply_modifiers")
+    layout.prop(operator, "use_cache")
+    layout.prop(operator, "triangulate")
+    layout.prop(operator, "split_submeshes")
+    layout.prop(operator, "write_report")
+    layout.prop(operator, "use_profile")
+    layout.prop(operator, "dry_run")
 
 
 def export_panel_include(layout, operator, is_file_browser):
@@ -353,8 +417,9 @@ def export_panel_gltf(layout, operator):
     header.use_property_split = False
     header.label(text="glTF options")
     if body:
-        body.enabled = (operator.filename_ext == ('.glb' or '.gltf'))
+        body.enabled = operator.filename_ext in ('.glb', '.gltf')
         body.prop(operator, "gltf_props")
+        body.prop(operator, "use_native_gltf")
  
 
 
@@ -381,61 +446,148 @@ def parent_meshes(operator, context, dupes):
 
 
 
-#need to add triangulation but i cba
+def is_preserved_shape(name):
+    return 'shpx_' in name.lower() or 'shp_' in name.lower()
+
+
+def plan_shapekey_fixes(dupes):
+    #walks every dupe once and records what shapekey_fixes has to do to it, keys are stored by name since the bake replaces them
+    plan = []
+    for o in filter(lambda obj: obj.type == 'MESH' and obj.data.shape_keys, dupes):
+        reference_key = o.data.shape_keys.reference_key
+        drop, apply, preserve = [], [], []
+        for shape in o.data.shape_keys.key_blocks:
+            if is_preserved_shape(shape.name):
+                preserve.append(shape.name)
+            elif shape == reference_key:
+                continue
+            elif shape.value == 0.0 or shape.mute:
+                drop.append(shape.name)
+            else:
+                apply.append(shape.name)
+        modifiers = [mod.name for mod in o.modifiers if mod.type != 'ARMATURE' and mod.show_viewport]
+        plan.append({
+            "object": o,
+            "drop": drop,
+            "apply": apply,
+            "preserve": preserve,
+            "modifiers": modifiers,
+            #without modifiers the bake would give back the same shapes
+            "bakes": 1 if preserve and modifiers else 0,
+        })
+    return plan
+
+
+def print_shapekey_plan(plan):
+    for step in plan:
+        print("shapekey_fixes: {name}: drop {drop}, apply {apply}, preserve {preserve}, modifiers {modifiers}, bakes {bakes}".format(
+            name=step["object"].name,
+            drop=len(step["drop"]),
+            apply=len(step["apply"]),
+            preserve=len(step["preserve"]),
+            modifiers=step["modifiers"],
+            bakes=step["bakes"],
+        ))
+    print("shapekey_fixes: {objects} objects, {bakes} bakes".format(objects=len(plan), bakes=sum(step["bakes"] for step in plan)))
+
+
 # https://blender.stackexchange.com/questions/322905/apply-all-shape-keys-to-selected-objects-except-certain-shape-keys
 # need to add apply shapekey to basis
 def shapekey_fixes(operator, context, dupes):
     
-
-    for o in filter(lambda obj: obj.type == 'MESH' and obj.data.shape_keys, dupes):
+    plan = plan_shapekey_fixes(dupes)
+    print_shapekey_plan(plan)
+
+    use_cache = getattr(operator, "use_cache", False)
+    for step in plan:
+        o = step["object"]
+        #triangulated here so the cache stores the triangulated mesh
+        step["triangulate"] = getattr(operator, "triangulate", False)
         if not o.visible_get():
             o.hide_set(False)
         context.view_layer.objects.active = o
 
+        #unchanged objects get their result from the last export
+        cache_key = cache.object_cache_key(o, step) if use_cache else None
+        if cache_key is not None and cache.load(o, cache_key, step):
+            print("shapekey_fixes: {name}: cached".format(name=o.name))
+            stats.count("cache_hits")
+            continue
+
+        key_blocks = o.data.shape_keys.key_blocks
+        for name in step["drop"]:
+            o.shape_key_remove(key_blocks[name])
+        stats.count("keys_removed", len(step["drop"]))
+
+        shapes_to_apply = [key_blocks[name] for name in step["apply"]]
+        #applies every key in one pass, falls back to one at a time for keys relative to other keys
+        if not apply_shape_keys_to_reference_key(o, shapes_to_apply):
+            for shape in shapes_to_apply:
+                o.active_shape_key_index = o.data.shape_keys.key_blocks.find(shape.name)
+                with context.temp_override(object=o):
+                    ShapeKeyToReferenceKey.execute(operator, context)
+                o.shape_key_remove(shape)
+        stats.count("keys_applied", len(shapes_to_apply))
+
+        #one bake handles every preserved key, the modifiers are gone from the object afterwards
+        if step["bakes"]:
+            context.view_layer.objects.active = o
+            o.active_shape_key_index = o.data.shape_keys.key_blocks.find(step["preserve"][0])
+            with stats.stage("bake"), stats.tracking_memory(o.name):
+                apply_modifiers_with_shape_keys(context, step["modifiers"])
+
+        if step["triangulate"]:
+            triangulate_object(o)
+
+        if cache_key is not None:
+            cache.store(o, cache_key)
 
-        #skip object if we cant set it for some reason
-        #if not o.visible_get():
-         #   continue
-        for shape in (shape for shape in o.data.shape_keys.key_blocks if (('shpx_' not in shape.name.lower() and 'shp_' not in shape.name.lower()) and (shape.value == 0.0 or shape.mute) and shape.name != o.data.shape_keys.reference_key.name)):
-            o.shape_key_remove(shape)
+    return
+    
+def check_vertex_limits(operator, dupes):
+    #counts what the exporter will actually write, seams and sharp edges split verts
+    counter = {}
+    for o in (o for o in dupes if o.type == 'MESH'):
+        major = widget.submesh_major(o.name)
+        if major is not None:
+            counter[major] = counter.get(major, 0) + widget.count_object(o, widget.settings["epsilon"], widget.settings["union"], split=True)
+    for major, count in sorted(counter.items()):
+        print("Submesh {major}: {val} exported verts".format(major=major, val=count))
+        if count > 65535:
+            operator.report({'WARNING'}, "Submesh {major} has {val} too many verts".format(val=count-65535, major=major))
+    return counter
 
-        shapes_to_delete, shapes_to_preserve = [], []
-        for shape in o.data.shape_keys.key_blocks:(
-            shapes_to_delete if 'shpx_' not in shape.name.lower() and 'shp_' not in shape.name.lower()
-        else shapes_to_preserve
-        ).append(shape)
-        #print("!!!!!!!!! Shapekey_fix pre op")
-        #print(o)
-        #print(o.data.shape_keys.key_blocks.values())
-        #print(context.blend_data.shape_keys['Butt Shapekeys'].key_blocks.find('shpx_wa_tre'))
-        #print(o.data.shape_keys.reference_key)
-        #code.interact(local=locals())
-        for shape in (shape for shape in shapes_to_delete if shape.name != o.data.shape_keys.reference_key.name and (shape.value > 0.0 or not shape.mute)):   
-            o.active_shape_key_index = o.data.shape_keys.key_blocks.find(shape.name)
-            print(o)
-            with context.temp_override(object=o):
-                ShapeKeyToReferenceKey.execute(operator, context)
-            o.shape_key_remove(shape)
-        
 
+text_handle = None
 
 
-        for shape in shapes_to_preserve:
-            context.view_layer.objects.active = o 
-            o.active_shape_key_index = o.data.shape_keys.key_blocks.find(shape.name)
-            
-            
-            selected_modifiers = [o.name for o in o.modifiers if o.type != 'ARMATURE' and o.show_viewport]
-            #code.interact(local=locals())
-            #print(dir(selected_modifiers))
-            #print("%d" % o.data.shape_keys.key_blocks.find(shape.name))
-            apply_modifiers_with_shape_keys(context, selected_modifiers)
-        #code.interact(local=locals())    
+def update_shapekey_counter(self, context):
+    widget.update_settings(self.ffxiv_shapekey_epsilon, self.ffxiv_shapekey_count_union,
+                           self.ffxiv_shapekey_count_split)
 
-        
-    return
-    
-text_handle = None
+
+# The counter's settings, on the window manager so they are kept for the session and can be changed while it runs
+counter_properties = {
+    "ffxiv_shapekey_epsilon": FloatProperty(
+        name="Tolerance",
+        description="Shapekey offsets no larger than this along every axis are ignored as float noise",
+        default=0.0,
+        min=0.0,
+        update=update_shapekey_counter,
+    ),
+    "ffxiv_shapekey_count_union": BoolProperty(
+        name="Count Each Vertex Once",
+        description="Count a vertex moved by several shapekeys once instead of once per shapekey",
+        default=False,
+        update=update_shapekey_counter,
+    ),
+    "ffxiv_shapekey_count_split": BoolProperty(
+        name="Count Exported Vertices",
+        description="Count the vertices the exporter writes, UV seams, sharp edges and colour changes split a vertex into several",
+        default=True,
+        update=update_shapekey_counter,
+    ),
+}
 
 classes = (
     ImportFile,
@@ -450,16 +602,20 @@ def menu_func_import(self, context):
     
 
 def menu_func_export(self, context):
-    self.layout.operator(ExportFile.bl_idname, text="Export FFXIV Model (.fbx/.glb/.gltf)")
+    self.layout.operator(ExportFile.bl_idname, text="Export FFXIV Model (.fbx/.glb/.gltf/.mdl)")
 
 def menu_func_shapes(self, context):
     self.layout.operator(ShapekeyCounter.bl_idname)
+    for name in counter_properties:
+        self.layout.prop(context.window_manager, name)
 
 
 def register(): 
 
     for cls in classes:
         bpy.utils.register_class(cls)
+    for name, prop in counter_properties.items():
+        setattr(bpy.types.WindowManager, name, prop)
 
     bpy.types.TOPBAR_MT_file_import.append(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.append(menu_func_export)
@@ -470,6 +626,8 @@ def unregister():
     bpy.types.TOPBAR_MT_file_import.remove(menu_func_import)
     bpy.types.TOPBAR_MT_file_export.remove(menu_func_export)
     bpy.types.VIEW3D_PT_overlay.remove(menu_func_shapes)
+    for name in counter_properties:
+        delattr(bpy.types.WindowManager, name)
     for cls in classes:
         bpy.utils.unregister_class(cls)
 
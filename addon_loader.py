@@ -0,0 +1,31 @@
+'''
+Loads the add-on for the scripts and tests that run it from this folder instead of through Blender's add-on manager.
+
+The package is imported from its __init__.py under a fixed name, so the folder can have any name, including ones that
+aren't valid module names like the ffxiv_blendertools-main of a GitHub zip.
+'''
+
+import importlib.util
+import os
+import sys
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Name the add-on is imported under
+ADDON_MODULE = "ffxiv_tools_addon"
+
+
+def load_addon():
+    ''' Imports the add-on once, registering it if the export operator isn't available yet, and returns it '''
+    import bpy
+    if ADDON_MODULE not in sys.modules:
+        spec = importlib.util.spec_from_file_location(ADDON_MODULE, os.path.join(PACKAGE_DIR, "__init__.py"),
+                                                      submodule_search_locations=[PACKAGE_DIR])
+        addon = importlib.util.module_from_spec(spec)
+        sys.modules[ADDON_MODULE] = addon
+        spec.loader.exec_module(addon)
+    addon = sys.modules[ADDON_MODULE]
+    try:
+        bpy.ops.export_scene.tool.get_rna_type()
+    except KeyError:
+        addon.register()
+    return addon
@@ -0,0 +1,217 @@
+'''
+Headless batch export driven by a job manifest.
+
+Driver, spreads the jobs over N background Blender processes and prints a JSON summary:
+    python batch_export.py jobs.toml -j 4 --summary summary.json
+    blender -b --python batch_export.py -- jobs.toml -j 4
+
+Manifest (JSON or TOML), relative paths are resolved against the manifest's folder:
+    [defaults]
+    format = ".glb"                 # .fbx, .gltf, .glb or .mdl
+    scope = "visible"               # visible, selected or scene
+    apply_modifiers = "YES_PRESERVE" # YES_PRESERVE, YES_APPLY or NO
+
+    [[jobs]]
+    blend = "body.blend"
+    output = "out/body.glb"
+
+Each Blender process opens one .blend and runs every job for it through the export_scene.tool operator.
+'''
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Blender doesn't put the folder of a --python script on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_loader import load_addon  # noqa: E402
+
+
+FORMATS = ('.fbx', '.gltf', '.glb', '.mdl')
+SCOPES = ('visible', 'selected', 'scene')
+APPLY_MODIFIERS = ('YES_PRESERVE', 'YES_APPLY', 'NO')
+
+DEFAULTS = {
+    "format": '.glb',
+    "scope": 'visible',
+    "apply_modifiers": 'YES_PRESERVE',
+}
+
+
+def load_manifest(path):
+    ''' Reads a JSON or TOML manifest and returns the list of jobs with defaults filled in and paths made absolute '''
+    with open(path, 'rb') as f:
+        if path.lower().endswith('.toml'):
+            import tomllib
+            manifest = tomllib.load(f)
+        else:
+            manifest = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    defaults = dict(DEFAULTS, **manifest.get("defaults", {}))
+    jobs = []
+    for i, entry in enumerate(manifest.get("jobs", [])):
+        job = dict(defaults, **entry)
+        for key in ("blend", "output"):
+            if not job.get(key):
+                raise ValueError(f"Job {i} is missing '{key}'")
+            job[key] = os.path.normpath(os.path.join(base_dir, job[key]))
+        if job["format"] not in FORMATS:
+            raise ValueError(f"Job {i} has an unknown format '{job['format']}', expected one of {FORMATS}")
+        if job["scope"] not in SCOPES:
+            raise ValueError(f"Job {i} has an unknown scope '{job['scope']}', expected one of {SCOPES}")
+        if job["apply_modifiers"] not in APPLY_MODIFIERS:
+            raise ValueError(f"Job {i} has an unknown apply_modifiers '{job['apply_modifiers']}', expected one of {APPLY_MODIFIERS}")
+        jobs.append(job)
+    return jobs
+
+
+def group_jobs(jobs):
+    ''' Groups jobs by .blend file so every file is only opened once '''
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job["blend"], []).append(job)
+    return list(groups.values())
+
+
+def run_group(blender, jobs, timeout=None):
+    ''' Runs every job of one .blend in a background Blender process and returns their results '''
+    with tempfile.TemporaryDirectory() as tmp:
+        jobs_path = os.path.join(tmp, "jobs.json")
+        results_path = os.path.join(tmp, "results.json")
+        with open(jobs_path, 'w') as f:
+            json.dump(jobs, f)
+
+        command = [blender, '-b', jobs[0]["blend"], '--factory-startup', '--python', os.path.abspath(__file__),
+                   '--', '--worker', jobs_path, results_path]
+        start = time.perf_counter()
+        try:
+            process = subprocess.run(command, capture_output=True, text=True, timeout=timeout)
+            log = process.stdout[-4000:] + process.stderr[-4000:]
+        except subprocess.TimeoutExpired:
+            log = f"Timed out after {timeout} seconds"
+        seconds = time.perf_counter() - start
+
+        if os.path.exists(results_path):
+            with open(results_path) as f:
+                results = json.load(f)
+        else:
+            results = []
+
+    # Jobs the worker never got to, because Blender crashed or timed out
+    for job in jobs[len(results):]:
+        results.append(dict(job, status='FAILED', error=log.strip() or "Blender exited without a result", seconds=seconds, bytes=0))
+    return results
+
+
+def run_manifest(path, workers=None, blender=None, timeout=None):
+    ''' Runs every job in the manifest and returns the summary '''
+    jobs = load_manifest(path)
+    groups = group_jobs(jobs)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(groups) or 1))
+    blender = blender or default_blender()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = [result for group in pool.map(lambda group: run_group(blender, group, timeout), groups) for result in group]
+
+    return {
+        "manifest": os.path.abspath(path),
+        "workers": workers,
+        "succeeded": sum(1 for result in results if result["status"] == 'FINISHED'),
+        "failed": sum(1 for result in results if result["status"] != 'FINISHED'),
+        "seconds": time.perf_counter() - start,
+        "jobs": results,
+    }
+
+
+def default_blender():
+    if "BLENDER" in os.environ:
+        return os.environ["BLENDER"]
+    try:
+        import bpy
+        return bpy.app.binary_path
+    except ImportError:
+        return 'blender'
+
+
+# Worker side, runs inside Blender with the .blend already open
+
+def export_job(job):
+    import bpy
+    os.makedirs(os.path.dirname(job["output"]), exist_ok=True)
+    result = bpy.ops.export_scene.tool(
+        filepath=job["output"],
+        filename_ext=job["format"],
+        use_visible=job["scope"] == 'visible',
+        use_selection=job["scope"] == 'selected',
+        apply_modifiers=job["apply_modifiers"],
+    )
+    return next(iter(result))
+
+
+def run_worker(jobs_path, results_path):
+    import bpy
+    load_addon()
+    with open(jobs_path) as f:
+        jobs = json.load(f)
+
+    results = []
+    for i, job in enumerate(jobs):
+        if i > 0:
+            # Every job starts from the file as it is on disk
+            bpy.ops.wm.revert_mainfile()
+        start = time.perf_counter()
+        try:
+            status = export_job(job)
+            error = None
+        except Exception as e:
+            status = 'FAILED'
+            error = str(e)
+        results.append(dict(job,
+                            status=status,
+                            error=error,
+                            seconds=time.perf_counter() - start,
+                            # a cancelled or failed job can leave an older file at the output
+                            bytes=os.path.getsize(job["output"]) if status == 'FINISHED' and os.path.exists(job["output"]) else 0))
+        # Written after every job so a crash keeps the finished results
+        with open(results_path, 'w') as f:
+            json.dump(results, f)
+
+
+def main(argv):
+    if argv[:1] == ['--worker']:
+        run_worker(*argv[1:3])
+        return 0
+
+    parser = argparse.ArgumentParser(prog="batch_export", description="Export FFXIV models from .blend files listed in a manifest")
+    parser.add_argument("manifest", help="JSON or TOML job manifest")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Number of Blender processes, defaults to the CPU count")
+    parser.add_argument("--blender", default=None, help="Blender executable, defaults to $BLENDER or the running Blender")
+    parser.add_argument("--timeout", type=float, default=None, help="Seconds before a Blender process is killed")
+    parser.add_argument("--summary", default=None, help="Write the JSON summary here instead of stdout")
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run_manifest(args.manifest, args.workers, args.blender, args.timeout)
+    except (OSError, ValueError) as e:
+        print(f"batch_export: {e}", file=sys.stderr)
+        return 2
+
+    if args.summary:
+        with open(args.summary, 'w') as f:
+            json.dump(summary, f, indent=2)
+    else:
+        print(json.dumps(summary, indent=2))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    # Inside Blender the script arguments come after "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
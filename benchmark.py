@@ -0,0 +1,270 @@
+'''
+Benchmarks the export pipeline on generated FFXIV-like meshes and fails when a stage scales worse than linearly.
+
+    blender -b --factory-startup --python benchmark.py -- --output bench.json
+    python benchmark.py --output bench.json            # with the bpy module, or starts $BLENDER -b otherwise
+
+Every fixture is one submesh ("Body 0.1") with N vertices, K shape keys (a third shp_ keys to preserve, a third to
+apply to the basis and a third muted to drop), M modifiers that keep the vertex count and an armature it is weighted
+to. Each stage is timed on a fresh fixture while N grows with K fixed, then while K grows with N fixed. The exponent of
+the fitted time ~ size^e curve is checked against --max-exponent, timings under --noise-floor seconds are not checked
+since they are mostly overhead.
+
+With --calibrate the whole export is timed over every N and K combination instead, and the cost model the export
+operator's Estimate Only option uses is fitted to those timings and saved.
+'''
+
+import argparse
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+# Blender doesn't put the folder of a --python script on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from addon_loader import load_addon  # noqa: E402
+
+
+DEFAULT_VERTS = (4096, 16384, 65536)
+DEFAULT_KEYS = (6, 24, 96)
+STAGES = ('shapekey_fixes', 'apply_modifiers_with_shape_keys', 'apply_shape_key_to_reference_key', 'widget_calc',
+          'export')
+
+
+def growth_exponent(sizes, seconds):
+    ''' Slope of log(seconds) over log(size), 1.0 is linear and 2.0 quadratic '''
+    return float(np.polyfit(np.log(sizes), np.log(np.maximum(seconds, 1e-9)), 1)[0])
+
+
+# Fixtures, everything below runs inside Blender
+
+def make_fixture(num_verts, num_keys, num_modifiers, num_bones=8, name="Body 0.1"):
+    ''' A grid mesh with shape keys, modifiers and an armature, returns the mesh object and the armature object '''
+    import bpy
+    side = max(2, math.isqrt(num_verts))
+    rng = np.random.default_rng(num_verts * 1000 + num_keys)
+
+    x, y = np.meshgrid(np.linspace(-0.5, 0.5, side, dtype=np.single), np.linspace(0.0, 1.8, side, dtype=np.single))
+    co = np.column_stack((x.ravel(), np.zeros(side * side, dtype=np.single), y.ravel()))
+    grid = np.arange(side * side, dtype=np.intc).reshape(side, side)
+    quads = np.column_stack((grid[:-1, :-1].ravel(), grid[:-1, 1:].ravel(), grid[1:, 1:].ravel(), grid[1:, :-1].ravel()))
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(co))
+    mesh.vertices.foreach_set("co", co.ravel())
+    mesh.loops.add(quads.size)
+    mesh.loops.foreach_set("vertex_index", quads.ravel())
+    mesh.polygons.add(len(quads))
+    mesh.polygons.foreach_set("loop_start", np.arange(0, quads.size, 4, dtype=np.intc))
+    mesh.update(calc_edges=True)
+    uv_layer = mesh.uv_layers.new(name="UVMap")
+    uv_layer.uv.foreach_set("vector", np.column_stack((co[:, 0] + 0.5, co[:, 2] / 1.8))[quads.ravel()].ravel())
+
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+
+    basis = obj.shape_key_add(name="Basis", from_mix=False)
+    key_co = np.empty(len(co) * 3, dtype=np.single)
+    for i in range(num_keys):
+        kind = i % 3
+        key = obj.shape_key_add(name=("shp_key_{i}", "apply_key_{i}", "drop_key_{i}")[kind].format(i=i), from_mix=False)
+        basis.data.foreach_get("co", key_co)
+        moved = rng.random(len(co)) < 0.1
+        key_co.reshape(-1, 3)[moved, 1] += rng.random(np.count_nonzero(moved), dtype=np.single) * 0.05
+        key.data.foreach_set("co", key_co)
+        key.value = (1.0, 0.5, 0.0)[kind]
+        key.mute = kind == 2
+
+    armature = bpy.data.armatures.new(name + " Armature")
+    arm_obj = bpy.data.objects.new(name + " Armature", armature)
+    bpy.context.scene.collection.objects.link(arm_obj)
+    bpy.context.view_layer.objects.active = arm_obj
+    bpy.ops.object.mode_set(mode='EDIT')
+    for b in range(num_bones):
+        bone = armature.edit_bones.new(f"j_bone_{b}")
+        bone.head = (0.0, 0.0, 1.8 * b / num_bones)
+        bone.tail = (0.0, 0.0, 1.8 * (b + 1) / num_bones)
+        if b:
+            bone.parent = armature.edit_bones[f"j_bone_{b - 1}"]
+    bpy.ops.object.mode_set(mode='OBJECT')
+
+    # every vertex is weighted to the bone of its band
+    band = np.minimum((co[:, 2] / 1.8 * num_bones).astype(np.intc), num_bones - 1)
+    for b in range(num_bones):
+        group = obj.vertex_groups.new(name=f"j_bone_{b}")
+        group.add(np.flatnonzero(band == b).tolist(), 1.0, 'REPLACE')
+    armature_mod = obj.modifiers.new("Armature", 'ARMATURE')
+    armature_mod.object = arm_obj
+
+    for m in range(num_modifiers):
+        if m % 2:
+            mod = obj.modifiers.new(f"Smooth {m}", 'SMOOTH')
+            mod.factor = 0.1
+        else:
+            mod = obj.modifiers.new(f"Displace {m}", 'DISPLACE')
+            mod.strength = 0.01
+    return obj, arm_obj
+
+
+def clear_scene():
+    import bpy
+    bpy.data.batch_remove(list(bpy.data.objects) + list(bpy.data.meshes) + list(bpy.data.armatures))
+
+
+class BenchOperator:
+    ''' Stands in for the export operator where the pipeline's helpers only need its settings and report '''
+    use_cache = False
+
+    def __init__(self):
+        self.reports = []
+
+    def report(self, type, message):
+        self.reports.append((sorted(type), message))
+
+
+def run_stage(addon, stage, obj, output_dir):
+    import bpy
+    context = bpy.context
+    context.view_layer.objects.active = obj
+    if stage == 'shapekey_fixes':
+        addon.shapekey_fixes(BenchOperator(), context, [obj])
+    elif stage == 'apply_modifiers_with_shape_keys':
+        obj.active_shape_key_index = 1
+        modifiers = [mod.name for mod in obj.modifiers if mod.type != 'ARMATURE']
+        addon.functions.apply_modifiers_with_shape_keys(context, modifiers)
+    elif stage == 'apply_shape_key_to_reference_key':
+        # applies every key the export would apply to the basis, one at a time like the fallback does
+        for name in [key.name for key in obj.data.shape_keys.key_blocks if key.name.startswith("apply_")]:
+            obj.active_shape_key_index = obj.data.shape_keys.key_blocks.find(name)
+            with context.temp_override(object=obj):
+                addon.functions.ShapeKeyToReferenceKey.execute(BenchOperator(), context)
+    elif stage == 'widget_calc':
+        addon.widget.calc(override=True)
+    elif stage == 'export':
+        bpy.ops.export_scene.tool(filepath=os.path.join(output_dir, "bench.glb"), filename_ext='.glb', use_cache=False)
+
+
+def time_stage(addon, stage, num_verts, num_keys, num_modifiers, repeat, output_dir):
+    ''' Best of repeat runs, each on a fresh fixture '''
+    best = math.inf
+    for _ in range(repeat):
+        clear_scene()
+        obj, _ = make_fixture(num_verts, num_keys, num_modifiers)
+        start = time.perf_counter()
+        run_stage(addon, stage, obj, output_dir)
+        best = min(best, time.perf_counter() - start)
+    clear_scene()
+    return best
+
+
+def calibrate(args):
+    ''' Fits the estimate cost model to export timings of every fixture size, returns what was saved '''
+    import bpy
+    bpy.ops.wm.read_homefile(use_empty=True)
+    addon = load_addon()
+    samples = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        # fixtures without modifiers don't bake, which tells the bake's cost apart from the shape keys'
+        for num_modifiers in sorted({0, args.modifiers}):
+            for num_verts in args.verts:
+                for num_keys in args.keys:
+                    obj, _ = make_fixture(num_verts, num_keys, num_modifiers)
+                    work = addon.estimate.object_work(obj, next(iter(addon.plan_shapekey_fixes([obj])), None))
+                    clear_scene()
+                    seconds = time_stage(addon, 'export', num_verts, num_keys, num_modifiers, args.repeat, output_dir)
+                    samples.append((addon.estimate.features(work), seconds))
+                    print(f"benchmark: calibrate: {num_verts} verts, {num_keys} keys, {num_modifiers} modifiers: "
+                          f"{seconds:.4f}s", flush=True)
+
+    coefficients = addon.estimate.fit(samples)
+    predicted = [sum(coefficients[name] * value for name, value in sample.items()) for sample, _ in samples]
+    model = {
+        "blender": bpy.app.version_string,
+        "coefficients": coefficients,
+        "samples": [{"features": sample, "seconds": seconds, "predicted": guess}
+                    for (sample, seconds), guess in zip(samples, predicted)],
+    }
+    path = args.calibrate or addon.estimate.cost_model_path()
+    with open(path, 'w') as f:
+        json.dump(model, f, indent=2)
+    print(f"benchmark: cost model written to {path}", flush=True)
+    return model
+
+
+def run_benchmarks(args):
+    import bpy
+    bpy.ops.wm.read_homefile(use_empty=True)
+    addon = load_addon()
+    results = {"blender": bpy.app.version_string, "stages": {}, "failed": []}
+
+    with tempfile.TemporaryDirectory() as output_dir:
+        for stage in args.stages:
+            entry = {}
+            for axis, sizes in (("verts", args.verts), ("keys", args.keys)):
+                runs = []
+                for size in sizes:
+                    num_verts, num_keys = (size, args.fixed_keys) if axis == "verts" else (args.fixed_verts, size)
+                    seconds = time_stage(addon, stage, num_verts, num_keys, args.modifiers, args.repeat, output_dir)
+                    runs.append({"verts": num_verts, "keys": num_keys, "seconds": seconds})
+                    print(f"benchmark: {stage}: {num_verts} verts, {num_keys} keys: {seconds:.4f}s", flush=True)
+
+                # a single size has no growth to check
+                checked = len(sizes) > 1 and max(run["seconds"] for run in runs) >= args.noise_floor
+                exponent = growth_exponent(sizes, [run["seconds"] for run in runs]) if len(sizes) > 1 else None
+                ok = not checked or exponent <= args.max_exponent
+                entry[axis] = {"runs": runs, "exponent": exponent, "checked": checked, "ok": ok}
+                if not ok:
+                    results["failed"].append(f"{stage} grows as {axis}^{exponent:.2f}")
+            results["stages"][stage] = entry
+    return results
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="benchmark", description="Time the export pipeline on generated meshes")
+    parser.add_argument("--output", default=None, help="Write the JSON results here instead of stdout")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--verts", type=int, nargs="+", default=list(DEFAULT_VERTS), help="Vertex counts to scale N over")
+    parser.add_argument("--keys", type=int, nargs="+", default=list(DEFAULT_KEYS), help="Shape key counts to scale K over")
+    parser.add_argument("--fixed-verts", type=int, default=DEFAULT_VERTS[1], help="Vertex count while K grows")
+    parser.add_argument("--fixed-keys", type=int, default=DEFAULT_KEYS[1], help="Shape key count while N grows")
+    parser.add_argument("--modifiers", type=int, default=2, help="Modifiers on every fixture besides the armature")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size, the fastest is kept")
+    parser.add_argument("--max-exponent", type=float, default=1.3, help="Fail when time grows faster than size^this")
+    parser.add_argument("--noise-floor", type=float, default=0.05, help="Seconds under which growth isn't checked")
+    parser.add_argument("--calibrate", nargs="?", const="", default=None, metavar="PATH",
+                        help="Fit the export estimate's cost model instead, saved where the add-on reads it unless PATH is given")
+    parser.add_argument("--blender", default=None, help="Blender executable when bpy can't be imported")
+    args = parser.parse_args(argv)
+
+    try:
+        import bpy  # noqa: F401
+    except ImportError:
+        # run ourselves inside a background Blender
+        blender = args.blender or os.environ.get("BLENDER", "blender")
+        command = [blender, '-b', '--factory-startup', '--python', os.path.abspath(__file__), '--'] + argv
+        return subprocess.run(command).returncode
+
+    if args.calibrate is not None:
+        calibrate(args)
+        return 0
+
+    results = run_benchmarks(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+    for failure in results["failed"]:
+        print(f"benchmark: FAILED: {failure}", file=sys.stderr)
+    return 0 if not results["failed"] else 1
+
+
+if __name__ == "__main__":
+    # Inside Blender the script arguments come after "--"
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    sys.exit(main(argv))
@@ -0,0 +1,268 @@
+import bpy
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from . import stats
+from .functions import ATTRIBUTE_LAYOUT, fast_mesh_shape_key_co_foreach_get, get_corner_tangents, vertex_weights
+
+# Bump whenever shapekey_fixes changes what it produces so old entries are never reused
+CACHE_VERSION = 5
+
+# Least recently used entries are removed once the cache grows past this
+MAX_CACHE_BYTES = 1024 * 1024 * 1024
+
+# Tangents looked up this session by tangent_key, so re-exports don't go back to disk
+_session_tangents = {}
+MAX_SESSION_TANGENTS = 256
+
+def cache_dir():
+    path = os.environ.get("FFXIV_EXPORT_CACHE") or os.path.join(tempfile.gettempdir(), "ffxiv_export_cache")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _hash_array(hasher, arr):
+    hasher.update(np.ascontiguousarray(arr).view(np.uint8))
+
+
+def _plain_values(item):
+    ''' The values of every property of an attribute element, with arrays as tuples so their repr is their contents '''
+    values = []
+    for prop in item.bl_rna.properties:
+        if prop.identifier == "rna_type":
+            continue
+        value = getattr(item, prop.identifier)
+        values.append(tuple(value) if getattr(prop, "is_array", False) else value)
+    return values
+
+
+def _hash_attributes(hasher, mesh):
+    hasher.update(repr((len(mesh.vertices), len(mesh.edges), len(mesh.loops), len(mesh.polygons))).encode())
+    for attribute in sorted(mesh.attributes, key=lambda a: a.name):
+        hasher.update(f"{attribute.name}:{attribute.domain}:{attribute.data_type}".encode())
+        layout = ATTRIBUTE_LAYOUT.get(attribute.data_type)
+        if layout is None:
+            # types without a bulk layout are read one element at a time, they are rare on exported meshes
+            hasher.update(repr([_plain_values(item) for item in attribute.data]).encode())
+            continue
+        prop, dtype, components = layout
+        arr = np.empty(len(attribute.data) * components, dtype=dtype)
+        attribute.data.foreach_get(prop, arr)
+        _hash_array(hasher, arr)
+
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.intc)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    _hash_array(hasher, loop_starts)
+
+    if mesh.has_custom_normals:
+        normals = np.empty(len(mesh.loops) * 3, dtype=np.single)
+        mesh.corner_normals.foreach_get("vector", normals)
+        _hash_array(hasher, normals)
+
+
+def _hash_custom_properties(hasher, data):
+    for name in sorted(data.keys()):
+        value = data[name]
+        if hasattr(value, "to_dict"):
+            value = value.to_dict()
+        elif hasattr(value, "to_list"):
+            value = value.to_list()
+        hasher.update(f"{name}={value!r}".encode())
+
+
+def _hash_weights(hasher, obj):
+    # groups are matched to bones by name, so renaming one has to miss the cache
+    hasher.update(repr([group.name for group in obj.vertex_groups]).encode())
+    weights = vertex_weights(obj.data)
+    _hash_array(hasher, weights.indptr)
+    _hash_array(hasher, weights.indices)
+    _hash_array(hasher, weights.data)
+
+
+def _hash_shape_keys(hasher, mesh):
+    shape_keys = mesh.shape_keys
+    if not shape_keys:
+        return
+    hasher.update(str(shape_keys.use_relative).encode())
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.single)
+    for key_block in shape_keys.key_blocks:
+        hasher.update(repr((key_block.name, key_block.value, key_block.mute, key_block.relative_key.name,
+                            key_block.vertex_group, key_block.slider_min, key_block.slider_max,
+                            key_block.interpolation)).encode())
+        fast_mesh_shape_key_co_foreach_get(key_block, co)
+        _hash_array(hasher, co)
+
+
+def _hash_modifiers(hasher, obj):
+    ''' Returns False if a baked modifier depends on another object, its result can't be keyed on this object alone '''
+    for mod in obj.modifiers:
+        hasher.update(f"{mod.name}:{mod.type}:{mod.show_viewport}".encode())
+        for prop in mod.bl_rna.properties:
+            if prop.is_readonly or prop.identifier in ("name", "show_expanded", "is_override_data_editable"):
+                continue
+            value = getattr(mod, prop.identifier)
+            if prop.type == 'POINTER':
+                if value is not None and mod.type != 'ARMATURE' and mod.show_viewport:
+                    return False
+                if mod.type == 'ARMATURE':
+                    # armatures aren't baked, and staged copies point at renamed armature copies, so an original and
+                    # its copy only share a key if the armature's name is left out
+                    value = value is not None
+                else:
+                    value = value.name if value is not None else None
+            elif prop.type in ('FLOAT', 'INT', 'BOOLEAN') and getattr(prop, "is_array", False):
+                value = tuple(value)
+            hasher.update(f"{prop.identifier}={value!r}".encode())
+    return True
+
+
+def object_cache_key(obj, step):
+    ''' Content hash of everything shapekey_fixes reads from obj, None if obj can't be cached '''
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"v{CACHE_VERSION}:{bpy.app.version}".encode())
+    if not _hash_modifiers(hasher, obj):
+        return None
+    hasher.update(repr((step["drop"], step["apply"], step["preserve"], step["modifiers"], step["bakes"],
+                        step.get("triangulate", False))).encode())
+    mesh = obj.data
+    _hash_attributes(hasher, mesh)
+    _hash_custom_properties(hasher, mesh)
+    _hash_shape_keys(hasher, mesh)
+    _hash_weights(hasher, obj)
+    return hasher.hexdigest()
+
+
+def _entry_path(key):
+    return os.path.join(cache_dir(), key + ".blend")
+
+
+def has_entry(key):
+    ''' Whether a result is stored for key, without loading it '''
+    return key is not None and os.path.exists(_entry_path(key))
+
+
+def load(obj, key, step):
+    ''' Swaps the cached result in as obj's mesh and removes the modifiers the bake would have applied.
+    Returns False on a cache miss '''
+    path = _entry_path(key)
+    if not os.path.exists(path):
+        return False
+
+    with bpy.data.libraries.load(path, link=False) as (data_from, data_to):
+        data_to.meshes = list(data_from.meshes[:1])
+    if not data_to.meshes or data_to.meshes[0] is None:
+        return False
+    new_mesh = data_to.meshes[0]
+    new_mesh.use_fake_user = False
+
+    # Materials aren't stored in the cache, reuse the ones already in this file
+    old_mesh = obj.data
+    for material in old_mesh.materials:
+        new_mesh.materials.append(material)
+    old_mesh_name = old_mesh.name
+    obj.data = new_mesh
+    bpy.data.meshes.remove(old_mesh)
+    new_mesh.name = old_mesh_name
+
+    if step["bakes"]:
+        for name in step["modifiers"]:
+            obj.modifiers.remove(obj.modifiers[name])
+
+    # Keep recently used entries from being evicted
+    os.utime(path)
+    return True
+
+
+def store(obj, key):
+    ''' Writes obj's fixed mesh to the cache, then evicts old entries '''
+    # Materials (and their images) would be written along with the mesh, so a copy without them is written instead of
+    # touching the slots of the mesh being exported
+    mesh = obj.data.copy()
+    mesh.materials.clear()
+    tmp_path = os.path.join(cache_dir(), f"{key}.{os.getpid()}.tmp")
+    try:
+        bpy.data.libraries.write(tmp_path, {mesh}, fake_user=True)
+        os.replace(tmp_path, _entry_path(key))
+    finally:
+        bpy.data.meshes.remove(mesh)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    evict()
+
+
+def evict(max_bytes=MAX_CACHE_BYTES):
+    ''' Removes the least recently used entries until the cache fits in max_bytes '''
+    directory = cache_dir()
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith((".blend", ".npy")):
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def tangent_key(vertex_co, corner_verts, loop_starts, normals, uv):
+    ''' Content hash of everything MikkTSpace reads: positions, topology, corner normals and the UV map '''
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"tangents:v{CACHE_VERSION}:{bpy.app.version}".encode())
+    for arr in (vertex_co, corner_verts, loop_starts, normals, uv):
+        hasher.update(repr(arr.shape).encode())
+        _hash_array(hasher, arr)
+    return hasher.hexdigest()
+
+
+def _tangent_path(key):
+    return os.path.join(cache_dir(), key + ".tangents.npy")
+
+
+def corner_tangents(mesh, vertex_co, corner_verts, normals, uv, use_cache=True):
+    ''' Tangents and bitangent signs of every corner of mesh as (num_loops, 4) following the active UV map, None if
+    the mesh has ngons. vertex_co, corner_verts, normals and uv are the arrays already read from mesh, unchanged
+    meshes reuse the tangents computed on an earlier export '''
+    uvmap = mesh.uv_layers.active.name
+    if not use_cache:
+        return get_corner_tangents(mesh, uvmap)
+
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.intc)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    key = tangent_key(vertex_co, corner_verts, loop_starts, normals, uv)
+    path = _tangent_path(key)
+
+    tangents = _session_tangents.pop(key, None)
+    if tangents is None and os.path.exists(path):
+        try:
+            tangents = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            tangents = None
+    if tangents is not None:
+        stats.count("tangent_cache_hits")
+    else:
+        tangents = get_corner_tangents(mesh, uvmap)
+        # meshes with ngons are stored empty, so they aren't retried either
+        if tangents is None:
+            tangents = np.empty((0, 4), dtype=np.single)
+        tmp_path = os.path.join(cache_dir(), f"{key}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, tangents)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        evict()
+
+    # most recently used last, the oldest is dropped first
+    _session_tangents[key] = tangents
+    while len(_session_tangents) > MAX_SESSION_TANGENTS:
+        del _session_tangents[next(iter(_session_tangents))]
+    return tangents if len(tangents) else None
@@ -0,0 +1,177 @@
+'''
+Predicts what an export will cost before running it, from the same plan shapekey_fixes follows.
+
+Time is a linear model over the work each object needs: its vertices, its shape key vertices, the vertices of the keys
+applied to the basis and the vertices the bake evaluates through the modifiers. The coefficients are fitted on the
+benchmark fixtures with `benchmark.py --calibrate`, rough defaults are used until then. Peak memory is worked out from
+the sizes of the copies the export keeps alive: every staged copy, plus the largest bake's working copy. With Reuse
+Unchanged Meshes, objects whose result is already in the cache cost only their staged copy.
+'''
+
+import json
+import os
+
+import numpy as np
+
+from . import cache
+from .cache import cache_dir
+from .functions import BAKE_CHUNK_SIZE
+
+# Seconds per unit of each feature, used until benchmark.py --calibrate has written a fitted model
+DEFAULT_COEFFICIENTS = {
+    "objects": 0.01,
+    "verts": 2e-7,
+    "key_verts": 2e-8,
+    "applied_key_verts": 5e-8,
+    "evaluated_verts": 1e-7,
+}
+FEATURES = tuple(DEFAULT_COEFFICIENTS)
+
+# Rough bytes Blender keeps per vertex of a mesh with its corners, normals, UVs and weights
+MESH_BYTES_PER_VERT = 256
+# One shape key position
+KEY_BYTES_PER_VERT = 12
+# Moved vertex index and offset of a baked key
+DELTA_BYTES_PER_VERT = 16
+
+
+def cost_model_path():
+    return os.environ.get("FFXIV_EXPORT_COST_MODEL") or os.path.join(cache_dir(), "cost_model.json")
+
+
+def load_coefficients():
+    ''' The calibrated coefficients, and whether there were any '''
+    try:
+        with open(cost_model_path()) as f:
+            fitted = json.load(f)["coefficients"]
+    except (OSError, ValueError, KeyError):
+        return dict(DEFAULT_COEFFICIENTS), False
+    return {name: float(fitted.get(name, default)) for name, default in DEFAULT_COEFFICIENTS.items()}, True
+
+
+def object_work(obj, step):
+    ''' What exporting obj involves, step is its entry of plan_shapekey_fixes or None if the fixes skip it '''
+    key_blocks = obj.data.shape_keys.key_blocks if obj.data.shape_keys else ()
+    work = {
+        "name": obj.name,
+        "verts": len(obj.data.vertices),
+        "shape_keys": max(len(key_blocks) - 1, 0),
+        "drop": 0,
+        "apply": 0,
+        "preserve": 0,
+        "modifiers": [],
+        "bake_evaluations": 0,
+        "cached": False,
+    }
+    if step is not None:
+        work.update(drop=len(step["drop"]), apply=len(step["apply"]), preserve=len(step["preserve"]),
+                    modifiers=list(step["modifiers"]))
+        # the basis through the modifiers, then one evaluation per preserved key
+        work["bake_evaluations"] = step["bakes"] * (len(step["preserve"]) + 1)
+    return work
+
+
+def features(work):
+    verts = work["verts"]
+    return {
+        "objects": 1,
+        "verts": verts,
+        "key_verts": verts * work["shape_keys"],
+        "applied_key_verts": verts * work["apply"],
+        "evaluated_verts": verts * work["bake_evaluations"] * max(len(work["modifiers"]), 1),
+    }
+
+
+def staged_bytes(work):
+    return work["verts"] * (MESH_BYTES_PER_VERT + KEY_BYTES_PER_VERT * (work["shape_keys"] + 1))
+
+
+def bake_bytes(work):
+    ''' The bake's working copy, the evaluated mesh and one chunk of baked keys, all alive at once '''
+    if not work["bake_evaluations"]:
+        return 0
+    verts = work["verts"]
+    copy = verts * (MESH_BYTES_PER_VERT + KEY_BYTES_PER_VERT * (work["preserve"] + 1))
+    return copy + verts * MESH_BYTES_PER_VERT + verts * DELTA_BYTES_PER_VERT * min(work["preserve"], BAKE_CHUNK_SIZE)
+
+
+def cached_step(obj, step, triangulate):
+    ''' Whether shapekey_fixes will get obj's result from the cache instead of running step '''
+    key = cache.object_cache_key(obj, dict(step, triangulate=triangulate))
+    return cache.has_entry(key)
+
+
+def estimate_export(objects, plan, coefficients=None, use_cache=False, triangulate=False):
+    ''' Predicted seconds and peak bytes of exporting the mesh objects, with the work and cost of each one, costliest
+    first. plan is what plan_shapekey_fixes returns for them, empty if the fixes don't run. With use_cache the objects
+    already in the cache are marked cached and skip the fixes, triangulate is the export's setting, part of the key '''
+    calibrated = True
+    if coefficients is None:
+        coefficients, calibrated = load_coefficients()
+    steps = {step["object"]: step for step in plan}
+
+    entries = []
+    for obj in (obj for obj in objects if obj.type == 'MESH'):
+        step = steps.get(obj)
+        cached = use_cache and step is not None and cached_step(obj, step, triangulate)
+        work = object_work(obj, None if cached else step)
+        work["cached"] = cached
+        work["seconds"] = sum(coefficients[name] * value for name, value in features(work).items())
+        work["bytes"] = staged_bytes(work) + bake_bytes(work)
+        entries.append(work)
+    entries.sort(key=lambda work: work["seconds"], reverse=True)
+
+    return {
+        "calibrated": calibrated,
+        "seconds": sum(work["seconds"] for work in entries),
+        # every staged copy is alive until the end, bakes run one at a time
+        "peak_bytes": sum(staged_bytes(work) for work in entries) + max((bake_bytes(work) for work in entries), default=0),
+        "bake_evaluations": sum(work["bake_evaluations"] for work in entries),
+        "cached": sum(work["cached"] for work in entries),
+        "objects": entries,
+    }
+
+
+def print_estimate(estimate):
+    for work in estimate["objects"]:
+        print("estimate: {name}: {verts} verts, {shape_keys} keys (drop {drop}, apply {apply}, preserve {preserve}), "
+              "modifiers {modifiers}, {bake_evaluations} bake evaluations, {seconds:.2f}s, {mb:.1f}MB{cached}".format(
+                  mb=work["bytes"] / 2**20, **dict(work, cached=", cached" if work["cached"] else "")))
+
+
+def summary(estimate, top=3):
+    ''' One line for the operator report '''
+    costliest = ", ".join(f"{work['name']} {work['seconds']:.2f}s" for work in estimate["objects"][:top])
+    calibration = "" if estimate["calibrated"] else " (uncalibrated, run benchmark.py --calibrate)"
+    return ("Estimated {seconds:.1f}s and {mb:.0f}MB peak, {evaluations} bake evaluations, {cached} objects cached"
+            "{calibration}; {costliest}").format(
+        seconds=estimate["seconds"], mb=estimate["peak_bytes"] / 2**20, evaluations=estimate["bake_evaluations"],
+        cached=estimate["cached"], calibration=calibration, costliest=costliest)
+
+
+def fit(samples):
+    ''' Non-negative least squares coefficients for samples of (features, seconds), solved with scipy when it is
+    installed. Blender doesn't ship scipy, without it features that would get a negative coefficient are dropped one at
+    a time, the most negative first, and the rest refitted. That is only an approximation of the non-negative
+    optimum, a dropped feature can belong in it '''
+    x = np.array([[sample[name] for name in FEATURES] for sample, _ in samples], dtype=np.float64)
+    y = np.array([seconds for _, seconds in samples], dtype=np.float64)
+    # columns are scaled to the same size so tiny per-vertex coefficients don't drown in the solve
+    scale = np.maximum(np.abs(x).max(axis=0), 1e-12)
+    x = x / scale
+    try:
+        from scipy.optimize import nnls
+    except ImportError:
+        nnls = None
+    if nnls is not None:
+        return dict(zip(FEATURES, (nnls(x, y)[0] / scale).tolist()))
+
+    active = np.ones(len(FEATURES), dtype=bool)
+    coefficients = np.zeros(len(FEATURES))
+    while active.any():
+        solution = np.linalg.lstsq(x[:, active], y, rcond=None)[0]
+        if (solution >= 0.0).all():
+            coefficients[active] = solution
+            break
+        active[np.flatnonzero(active)[np.argmin(solution)]] = False
+    return dict(zip(FEATURES, (coefficients / scale).tolist()))
@@ -17,6 +17,7 @@ Created by Wayne Dixon
 
 
 import bpy
+import bmesh
 import re
 import code
 from bpy.types import (
@@ -28,11 +29,13 @@ from bpy.types import (
     ShapeKey,
 )
 
-from collections.abc import Iterator
+from contextlib import contextmanager
 from types import SimpleNamespace
 from typing import cast, TypeVar
 
 import numpy as np
+
+from . import stats
 T = TypeVar("T", bound=Operator)
 
 # From apply modifiers to shapekeys
@@ -65,10 +68,23 @@ def evaluate_mesh(context, obj):
     """Low-level alternative to `bpy.ops.object.convert` for converting to meshes"""
     depsgraph = context.evaluated_depsgraph_get()
     eval_obj = obj.evaluated_get(depsgraph)
+    stats.count("depsgraph_evaluations")
     mesh = context.blend_data.meshes.new_from_object(eval_obj, preserve_all_data_layers=True, depsgraph=depsgraph)
     return mesh
 
 
+def get_evaluated_vertex_co(context, obj, out):
+    ''' Reads the evaluated vertex positions of the object straight into `out` without building a new mesh.
+    Returns False if the evaluated mesh does not have len(out) // 3 vertices '''
+    depsgraph = context.evaluated_depsgraph_get()
+    eval_mesh = obj.evaluated_get(depsgraph).data
+    stats.count("depsgraph_evaluations")
+    if len(eval_mesh.vertices) * 3 != len(out):
+        return False
+    get_mesh_vertex_co(eval_mesh, out)
+    return True
+
+
 def apply_modifier_to_object(context, obj, selected_modifiers):
     ''' Disables all modifers except the selected ones
     Creates a new mesh from that output and swaps it out
@@ -127,22 +143,23 @@ def restore_shape_key_properties(obj, property_dict):
         for prop, value in properties.items():
                 setattr(key_block, prop, value)
 
-def join_as_shape(temp_obj, original_obj):
+def join_as_shape(temp_obj, original_obj, co_buffer=None):
     '''Join the temp object back to the original as a shape key 
     Vertex positions are transferred by index.
     Different number of vertices or index will give unpredictable results
+    Pass the returned buffer back in to reuse it for the next shape key of the same object
     '''
 
-    # create a basis shape on the temp object to make the next step easier
-    temp_obj_shape = temp_obj.shape_key_add(from_mix=False)
-    # temp_obj_verts = temp_obj.data.shape_keys.key_blocks[1:]
     new_org_shape = original_obj.shape_key_add(from_mix=False)
 
-    # Transfer Vertex Positions
-    for source_vert, target_vert in zip(temp_obj_shape.data, new_org_shape.data):
-        target_vert.co = source_vert.co
+    # Transfer Vertex Positions in bulk, the temp mesh has no shape keys so its vertices are the shape
+    num_co = len(temp_obj.data.vertices) * 3
+    if co_buffer is None or len(co_buffer) != num_co:
+        co_buffer = np.empty(num_co, dtype=np.single)
+    get_mesh_vertex_co(temp_obj.data, co_buffer)
+    fast_mesh_shape_key_co_foreach_set(new_org_shape, co_buffer)
 
-    # return {'FINISHED'}
+    return co_buffer
 
 
 def save_shape_key_drivers(obj, property_dict):
@@ -265,12 +282,46 @@ def copy_shape_key_animation(source_obj, target_obj):
     # print(f"Shape key animations copied from {source_obj.name} to {target_obj.name}.") # DEBUG
 
 
+def bake_shape_keys_single_object(context, copy_obj, selected_modifiers, basis_co, key_indices=None):
+    ''' Evaluates shape keys of copy_obj through the selected modifiers by pinning one key at a time on the same object.
+    key_indices are the key blocks to bake, every key but the basis by default.
+    Returns a SparseDelta per shape key relative to basis_co (the baked basis) and a list of the shape key names that failed '''
+    key_blocks = copy_obj.data.shape_keys.key_blocks
+    if key_indices is None:
+        key_indices = range(1, len(key_blocks)) # index 0 (Basis) is not baked
+
+    # Only the selected modifiers should be evaluated
+    for modifier in copy_obj.modifiers:
+        modifier.show_viewport = modifier.name in selected_modifiers
+    copy_obj.show_only_shape_key = True
+
+    # one scratch buffer for the evaluated positions, only the moved verts are kept
+    co = np.empty(len(basis_co), dtype=np.single)
+    baked = []
+    failed = []
+    for i in key_indices:
+        copy_obj.active_shape_key_index = i
+        if not get_evaluated_vertex_co(context, copy_obj, co):
+            failed.append(key_blocks[i].name)
+            baked.append(None)
+            continue
+        baked.append(SparseDelta.from_co(co, basis_co))
+    return baked, failed
+
+
+# Shape keys baked before they are added back to the original, so only this many baked keys are held at once
+BAKE_CHUNK_SIZE = 16
+
+
 # Primary function (this gets imported and used by the operator)
-def apply_modifiers_with_shape_keys(context, selected_modifiers):
-    ''' Apply the selected modifiers to the mesh even if it has shape keys '''
+def apply_modifiers_with_shape_keys(context, selected_modifiers, single_object=True, chunk_size=BAKE_CHUNK_SIZE):
+    ''' Apply the selected modifiers to the mesh even if it has shape keys
+    With single_object the shape keys are baked on one working object instead of one duplicate per shape key,
+    chunk_size at a time '''
     original_obj = context.view_layer.objects.active
     shapes_count = len(original_obj.data.shape_keys.key_blocks) if original_obj.data.shape_keys else 0
     error_message = None
+    stats.count("bakes")
 
     if shapes_count == 1: # if there is only a Basis shape, delete the shape and apply the modifiers
         original_obj.shape_key_remove(original_obj.data.shape_keys.key_blocks[0])
@@ -301,40 +352,66 @@ def apply_modifiers_with_shape_keys(context, selected_modifiers):
     # Add a basis shape key back to the original object
     original_obj.shape_key_add(name=copy_obj.data.shape_keys.key_blocks[0].name,from_mix=False)
 
-    # Loop over the original shape keys, create a temp mesh, apply single shape, apply modifers and merge back to the original (1 shape at a time)
-    for i, (key_block_name, properties) in enumerate(shape_key_properties.items()):
-        # Create a temp object
-        context.view_layer.objects.active = copy_obj
-        temp_obj = duplicate_object(context, copy_obj)
-
-        # Pin the shape we want
+    if single_object:
+        # Evaluate every shape on the copy, then add them all back to the original as movement from the new basis
+        basis_co = np.empty(len(original_obj.data.vertices) * 3, dtype=np.single)
+        fast_mesh_shape_key_co_foreach_get(original_obj.data.shape_keys.reference_key, basis_co)
+        # each chunk is added to the original before the next is baked, which bounds the memory held by baked keys
+        temp_co_array = np.empty_like(basis_co)
+        key_block_names = list(shape_key_properties.keys())
+        for start in range(0, len(key_block_names), chunk_size):
+            chunk = key_block_names[start:start + chunk_size]
+            baked, _ = bake_shape_keys_single_object(context, copy_obj, selected_modifiers, basis_co,
+                                                     range(start + 1, start + 1 + len(chunk)))
+            for key_block_name, delta in zip(chunk, baked):
+                if delta is None:
+                    error_message = f"{key_block_name} failed because the mesh no longer have the same amount of vertices after applying selected modifier(s)."
+                    continue
+                new_org_shape = original_obj.shape_key_add(name=key_block_name, from_mix=False)
+                fast_mesh_shape_key_co_add_sparse(new_org_shape, delta, temp_co_array)
+            del baked
+            stats.sample_datablocks()
+    else:
+        # Loop over the original shape keys, create a temp mesh, apply single shape, apply modifers and merge back to the original (1 shape at a time)
+        co_buffer = None
+        for i, (key_block_name, properties) in enumerate(shape_key_properties.items()):
+            # Create a temp object
+            context.view_layer.objects.active = copy_obj
+            temp_obj = duplicate_object(context, copy_obj)
+
+            # Pin the shape we want
         
-        #code.interact(local=locals())
-        temp_obj.show_only_shape_key = True
-        temp_obj.active_shape_key_index = i + 1 
-        shape_key_name = temp_obj.active_shape_key.name
-        temp_obj_old_mesh = temp_obj.data
-
-        # Disable all modifiers (including selected)
-        for modifier in temp_obj.modifiers:
-            modifier.show_viewport = False
+            #code.interact(local=locals())
+            temp_obj.show_only_shape_key = True
+            temp_obj.active_shape_key_index = i + 1 
+            shape_key_name = temp_obj.active_shape_key.name
+            temp_obj_old_mesh = temp_obj.data
+
+            # Disable all modifiers (including selected)
+            for modifier in temp_obj.modifiers:
+                modifier.show_viewport = False
         
 
-        # Now freeze the mesh by applying the selected modifiers
-        apply_modifier_to_object(context, temp_obj, selected_modifiers)
+            # Now freeze the mesh by applying the selected modifiers
+            apply_modifier_to_object(context, temp_obj, selected_modifiers)
         
-        # Verify the meshes have the same amount of verts
-        if len(original_obj.data.vertices) != len(temp_obj.data.vertices):
-            error_message = f"{shape_key_name} failed because the mesh no longer have the same amount of vertices after applying selected modifier(s)."
-            # Clean up the temp object and try to move on
+            # Verify the meshes have the same amount of verts
+            if len(original_obj.data.vertices) != len(temp_obj.data.vertices):
+                error_message = f"{shape_key_name} failed because the mesh no longer have the same amount of vertices after applying selected modifier(s)."
+                # Clean up the temp object and try to move on
+                temp_mesh = temp_obj.data
+                context.blend_data.objects.remove(temp_obj)
+                context.blend_data.meshes.remove(temp_mesh)
+                continue
+
+            # Transfer the temp object as a shape back to orginal
+            co_buffer = join_as_shape(temp_obj, original_obj, co_buffer)
+            stats.sample_datablocks()
+
+            # Clean up the temp object and its mesh before the next shape key makes another
+            temp_mesh = temp_obj.data
             context.blend_data.objects.remove(temp_obj)
-            continue
-
-        # Transfer the temp object as a shape back to orginal
-        join_as_shape(temp_obj, original_obj)
-
-        # Clean up the temp object
-        context.blend_data.meshes.remove(temp_obj.data)
+            context.blend_data.meshes.remove(temp_mesh)
 
 
     # Restore shape key properties
@@ -346,8 +423,10 @@ def apply_modifiers_with_shape_keys(context, selected_modifiers):
     # Restore any shape key drivers
     restore_shape_key_drivers(original_obj, copy_obj, shape_key_drivers, context)
 
-    # Clean up the duplicate object
-    context.blend_data.meshes.remove(copy_obj.data)
+    # Clean up the duplicate object and its mesh
+    copy_mesh = copy_obj.data
+    context.blend_data.objects.remove(copy_obj)
+    context.blend_data.meshes.remove(copy_mesh)
 
     # Restore the pin option setting and active shape key index
     original_obj.show_only_shape_key = pin_setting
@@ -508,6 +587,21 @@ def fast_mesh_shape_key_co_foreach_set(shape_key: ShapeKey, arr: np.ndarray):
         shape_key.data.foreach_set("co", arr)
 
 
+def fast_mesh_shape_key_co_add_sparse(shape_key: ShapeKey, sparse_delta: "SparseDelta", temp_co_array: np.ndarray):
+    """
+    Add a SparseDelta to a Shape Key's coordinates. When the Shape Key's memory can be accessed directly, only the moved
+    Vertices are touched, otherwise all coordinates are read into `temp_co_array` and written back.
+    """
+    co_memory_as_array = _shape_key_co_memory_as_ndarray(shape_key)
+    if co_memory_as_array is not None:
+        sparse_delta.add_to(co_memory_as_array)
+        shape_key.data.update()
+    else:
+        shape_key.data.foreach_get("co", temp_co_array)
+        sparse_delta.add_to(temp_co_array)
+        shape_key.data.foreach_set("co", temp_co_array)
+
+
 # Blender Classes
 
 
@@ -704,37 +798,199 @@ def get_recursive_relative_shape_keys(all_shape_keys: Key,
     return recursively_relative_to_current_ref_key, recursively_relative_to_new_ref_key
 
 
-def vertex_group_weight_generator(mesh: Mesh, vertex_group_index: int) -> Iterator[float]:
+class VertexWeights:
+    """
+    Vertex Group weights of a Mesh as a sparse CSR (Vertex × Vertex Group) matrix.
+    Row `v` holds the Vertex Groups of Vertex `v` in `indices[indptr[v]:indptr[v + 1]]` and their weights in `data`.
+    """
+    __slots__ = 'num_verts', 'indptr', 'indices', 'data', '_rows', '_column_order', '_column_ptr'
+
+    def __init__(self, num_verts: int, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        self.num_verts = num_verts
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        # The column lookup is only built the first time a column is requested.
+        self._rows = None
+        self._column_order = None
+        self._column_ptr = None
+
+    @classmethod
+    def from_mesh(cls, mesh: Mesh) -> "VertexWeights":
+        # Blender has no efficient way to get all the weights for a particular Vertex Group.
+        # https://developer.blender.org/D6227 has the sort of function that is needed, which could make it into Blender
+        # one day.
+        #
+        # Reading each Vertex's groups once gets the weights of every Vertex Group in a single pass, where reading one
+        # Vertex Group at a time would go through every Vertex's groups once per Vertex Group, which scales poorly with
+        # lots of vertex groups assigned to each vertex.
+        # An alternative method is to use `VertexGroup.weight(vertex_index)`, but it raises an Error when the vertex
+        # index is not in the Vertex Group, and relying on catching the Error is really slow.
+        num_verts = len(mesh.vertices)
+        counts = np.empty(num_verts, dtype=np.intc)
+        indices = []
+        weights = []
+        for v in mesh.vertices:
+            groups = v.groups
+            counts[v.index] = len(groups)
+            for g in groups:
+                indices.append(g.group)
+                weights.append(g.weight)
+
+        indptr = np.zeros(num_verts + 1, dtype=np.intc)
+        np.cumsum(counts, out=indptr[1:])
+        return cls(num_verts, indptr, np.array(indices, dtype=np.intc), np.array(weights, dtype=np.single))
+
+    def column(self, vertex_group_index: int) -> np.ndarray:
+        """
+        Get the weights of a Vertex Group for every Vertex. Vertices not in the Vertex Group get 0.0.
+        :param vertex_group_index: Index of the Vertex Group.
+        :return: Array of length `num_verts`.
+        """
+        if self._column_order is None:
+            self._rows = np.repeat(np.arange(self.num_verts, dtype=np.intc), np.diff(self.indptr))
+            # Stable, so rows stay in Vertex order within each column.
+            self._column_order = np.argsort(self.indices, kind='stable')
+            self._column_ptr = self.indices[self._column_order]
+
+        start, end = np.searchsorted(self._column_ptr, (vertex_group_index, vertex_group_index + 1))
+        in_column = self._column_order[start:end]
+        weights = np.zeros(self.num_verts, dtype=np.single)
+        weights[self._rows[in_column]] = self.data[in_column]
+        return weights
+
+
+# Keyed by `Mesh.session_uid`, which is never reused within a session, so a Mesh replaced by a modifier bake can't pick
+# up the weights of the Mesh it replaced. Only used inside `vertex_weight_cache()` because weights can be painted in
+# between calls otherwise.
+_vertex_weights_cache: dict[int, VertexWeights] | None = None
+
+
+@contextmanager
+def vertex_weight_cache():
     """
-    Generator for Vertex Group weights. Yields 0.0 when a Vertex does not belong to the Vertex Group.
+    Reuse the weights from `vertex_weights` for each Mesh until the end of the `with` block.
+    Weights must not be changed inside the block.
+    """
+    global _vertex_weights_cache
+    outer = _vertex_weights_cache
+    if outer is None:
+        _vertex_weights_cache = {}
+    try:
+        yield
+    finally:
+        if outer is None:
+            _vertex_weights_cache = None
+
+
+def vertex_weights(mesh: Mesh) -> VertexWeights:
+    """
+    Get the Vertex Group weights of a Mesh, from the cache when inside `vertex_weight_cache()`.
     :param mesh:
-    :param vertex_group_index:
     :return:
     """
-    # Blender has no efficient way to get all the weights for a particular Vertex Group.
-    # It's pretty much always a few times faster to create a new Shape Key from mix and get its "co" with
-    # #foreach_get, but that requires temporarily muting all other Shape Keys and disabling `Object.show_only_shape_key`
-    # to ensure the new shape is created with the correct mix.
-    # For simplicity, and because Vertex Groups are rarely used on Shape Keys, the slower access of Vertex Group weights
-    # is used here.
-    # https://developer.blender.org/D6227 has the sort of function that is needed, which could make it into Blender one
-    # day.
-    # There has also been talk of Vertex Groups possibly becoming more like generic Mesh Attributes in the future, which
-    # would hopefully be able to use some, or all, of the Attributes API.
-
-    # This method for getting Vertex Group weights scales poorly with lots of vertex groups assigned to each vertex.
-    #
-    # An alternative method is to use `VertexGroup.weight(vertex_index)`, which does not scale poorly. However, it
-    # raises an Error when the vertex index is not in the Vertex Group, and relying on catching the Error is really
-    # slow.
-    for v in mesh.vertices:
-        for g in v.groups:
-            if g.group == vertex_group_index:
-                yield g.weight
-                break
-        else:
-            # No matching vertex group index found.
-            yield 0.0
+    if _vertex_weights_cache is None:
+        return VertexWeights.from_mesh(mesh)
+    weights = _vertex_weights_cache.get(mesh.session_uid)
+    if weights is None or weights.num_verts != len(mesh.vertices):
+        weights = VertexWeights.from_mesh(mesh)
+        _vertex_weights_cache[mesh.session_uid] = weights
+    return weights
+
+
+class SparseDelta:
+    """
+    Movement of a Shape Key relative to other coordinates, stored only for the Vertices that move.
+    `indices` are the sorted indices of the moved Vertices and `deltas` their (len(indices), 3) single precision
+    movement.
+    """
+    __slots__ = 'num_verts', 'indices', 'deltas'
+
+    def __init__(self, num_verts: int, indices: np.ndarray, deltas: np.ndarray):
+        self.num_verts = num_verts
+        self.indices = indices
+        self.deltas = deltas
+
+    @classmethod
+    def empty(cls, num_verts: int) -> "SparseDelta":
+        return cls(num_verts, np.empty(0, dtype=np.intc), np.empty((0, 3), dtype=np.single))
+
+    @classmethod
+    def from_co(cls, co_flat: np.ndarray, relative_co_flat: np.ndarray, tolerance: float = 0.0) -> "SparseDelta":
+        """
+        :param co_flat: Flat coordinates of the Shape Key.
+        :param relative_co_flat: Flat coordinates the movement is relative to.
+        :param tolerance: Vertices that move no more than this on every axis are treated as not moving.
+        """
+        num_verts = len(co_flat) // 3
+        difference = np.subtract(co_flat, relative_co_flat).reshape(num_verts, 3)
+        indices = np.flatnonzero((np.abs(difference) > tolerance).any(axis=1)).astype(np.intc)
+        return cls(num_verts, indices, difference[indices])
+
+    @classmethod
+    def from_shape_key(cls, shape_key: ShapeKey, relative_co_flat: np.ndarray, tolerance: float = 0.0,
+                       temp_co_array: np.ndarray = None) -> "SparseDelta":
+        """
+        :param temp_co_array: Optional scratch array of the same length as `relative_co_flat`, to avoid allocating one.
+        """
+        if temp_co_array is None:
+            temp_co_array = np.empty(len(relative_co_flat), dtype=np.single)
+        fast_mesh_shape_key_co_foreach_get(shape_key, temp_co_array)
+        return cls.from_co(temp_co_array, relative_co_flat, tolerance)
+
+    @classmethod
+    def sum(cls, num_verts: int, sparse_deltas: list["SparseDelta"]) -> "SparseDelta":
+        """
+        Add many SparseDeltas at once, cheaper than adding them one pair at a time.
+        """
+        if not sparse_deltas:
+            return cls.empty(num_verts)
+        all_indices = np.concatenate([d.indices for d in sparse_deltas])
+        indices, inverse = np.unique(all_indices, return_inverse=True)
+        deltas = np.zeros((len(indices), 3), dtype=np.single)
+        np.add.at(deltas, inverse, np.concatenate([d.deltas for d in sparse_deltas]))
+        return cls(num_verts, indices.astype(np.intc), deltas)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def add(self, other: "SparseDelta") -> "SparseDelta":
+        return SparseDelta.sum(self.num_verts, [self, other])
+
+    def subtract(self, other: "SparseDelta") -> "SparseDelta":
+        return SparseDelta.sum(self.num_verts, [self, other.scale(-1.0)])
+
+    def scale(self, factor) -> "SparseDelta":
+        """
+        :param factor: A single value, or one weight per Vertex such as a Vertex Group column.
+        """
+        if np.ndim(factor) == 0:
+            return SparseDelta(self.num_verts, self.indices, self.deltas * np.single(factor))
+        return SparseDelta(self.num_verts, self.indices, self.deltas * factor[self.indices].reshape(-1, 1))
+
+    def union(self, other: "SparseDelta") -> np.ndarray:
+        """
+        Get the sorted indices of the Vertices moved by either SparseDelta.
+        """
+        return np.union1d(self.indices, other.indices)
+
+    def prune(self, tolerance: float = 0.0) -> "SparseDelta":
+        """
+        Drop Vertices whose movement is no more than `tolerance` on every axis, such as those scaled by a zero weight.
+        """
+        keep = (np.abs(self.deltas) > tolerance).any(axis=1)
+        return SparseDelta(self.num_verts, self.indices[keep], self.deltas[keep])
+
+    def add_to(self, co_flat: np.ndarray):
+        """
+        Add the movement to flat coordinates in-place.
+        """
+        co_flat.reshape(-1, 3)[self.indices] += self.deltas
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros((self.num_verts, 3), dtype=np.single)
+        dense[self.indices] = self.deltas
+        return dense.ravel()
 
 
 # Figures out what needs to be added to each affected Shape key, then iterates through all the affected Shape keys,
@@ -789,8 +1045,7 @@ def apply_new_reference_key(obj: Object,
 
     if new_ref_key_vertex_group:
         # Scale the difference based on the Vertex Group.
-        vertex_weight_generator = vertex_group_weight_generator(mesh, new_ref_key_vertex_group.index)
-        vertex_group_weights = np.fromiter(vertex_weight_generator, difference_co_flat_value_scaled.dtype, num_verts)
+        vertex_group_weights = vertex_weights(mesh).column(new_ref_key_vertex_group.index)
 
         # Both arrays must be promoted to 2D views so that broadcasting can occur due to there being only a single
         # Vertex Group weight per vector.
@@ -966,12 +1221,297 @@ def apply_new_reference_key(obj: Object,
     # entered and exited, which can cause odd behaviour when creating Shape Keys with `from_mix=False`, when removing
     # all Shape Keys or exporting as a format that supports exporting Shape Keys.
     fast_mesh_shape_key_co_foreach_get(mesh.shape_keys.reference_key, temp_co_array)
+    set_mesh_vertex_co(mesh, temp_co_array)
+
+
+def get_mesh_vertex_co(mesh: Mesh, co_flat: np.ndarray):
+    """
+    Get the Vertex positions of a Mesh into a flat single precision array.
+    :param mesh: Mesh to read.
+    :param co_flat: Array of length `3 * len(mesh.vertices)`.
+    """
     # The "position" Attribute giving faster access to a Mesh's Vertex positions was added in Blender 3.5.
     if bpy.app.version >= (3, 5):
         position_attribute = mesh.attributes.get("position")
         if (position_attribute
                 and position_attribute.data_type == 'FLOAT_VECTOR'
                 and position_attribute.domain == 'POINT'):
-            position_attribute.data.foreach_set("vector", temp_co_array)
-    else:
-        mesh.vertices.foreach_set("co", temp_co_array)
\ No newline at end of file
+            position_attribute.data.foreach_get("vector", co_flat)
+            return
+    mesh.vertices.foreach_get("co", co_flat)
+
+
+def set_mesh_vertex_co(mesh: Mesh, co_flat: np.ndarray):
+    """
+    Set the Vertex positions of a Mesh from a flat single precision array.
+    :param mesh: Mesh to update.
+    :param co_flat: Array of length `3 * len(mesh.vertices)`.
+    """
+    # The "position" Attribute giving faster access to a Mesh's Vertex positions was added in Blender 3.5.
+    if bpy.app.version >= (3, 5):
+        position_attribute = mesh.attributes.get("position")
+        if (position_attribute
+                and position_attribute.data_type == 'FLOAT_VECTOR'
+                and position_attribute.domain == 'POINT'):
+            position_attribute.data.foreach_set("vector", co_flat)
+            return
+    mesh.vertices.foreach_set("co", co_flat)
+
+
+def exported_vertex_sources(mesh: Mesh) -> np.ndarray:
+    """
+    Get the source Vertex index of every vertex an exporter writes for `mesh`.
+
+    glTF and FBX exporters split a Vertex once for every distinct combination of normal, UVs and colours among its
+    corners, so a Vertex on a UV seam or a sharp edge is written more than once. Each corner's Vertex index and
+    attributes are packed into one row and the unique rows are the exported vertices. Loose Vertices are not exported.
+    :param mesh: Mesh to count.
+    :return: Array with the source Vertex index of each exported vertex.
+    """
+    num_loops = len(mesh.loops)
+    corner_verts = np.empty(num_loops, dtype=np.intc)
+    mesh.loops.foreach_get("vertex_index", corner_verts)
+    columns = [corner_verts]
+
+    def add_float_column(collection, prop, width):
+        arr = np.empty(num_loops * width, dtype=np.single)
+        collection.foreach_get(prop, arr)
+        columns.append(arr.reshape(num_loops, width))
+
+    add_float_column(mesh.corner_normals, "vector", 3)
+    for uv_layer in mesh.uv_layers:
+        add_float_column(uv_layer.uv, "vector", 2)
+    for color_attribute in mesh.color_attributes:
+        if color_attribute.domain == 'CORNER':
+            add_float_column(color_attribute.data, "color", 4)
+
+    first_corner, _ = unique_rows(columns)
+    return corner_verts[first_corner]
+
+
+def unique_rows(columns: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Find the unique rows of a table given as columns of 32-bit values, such as per-corner attributes.
+    :param columns: Arrays of shape (num_rows,) or (num_rows, width) with a 4 byte dtype.
+    :return: The index of the first row of each unique row, and the index of the unique row of every row.
+    """
+    num_rows = len(columns[0])
+    packed = []
+    for column in columns:
+        if column.dtype.kind == 'f':
+            # -0.0 and 0.0 are the same value but not the same bits.
+            column = np.add(column, 0.0, dtype=np.single)
+        packed.append(np.ascontiguousarray(column).view(np.uint32).reshape(num_rows, -1))
+    rows = np.hstack(packed)
+    # View each row as a single opaque element so np.unique compares whole rows with one sort.
+    rows_as_void = rows.view(np.dtype((np.void, rows.itemsize * rows.shape[1]))).ravel()
+    _, first_row, row_to_unique = np.unique(rows_as_void, return_index=True, return_inverse=True)
+    return first_row, row_to_unique.reshape(-1)
+
+
+def get_corner_tangents(mesh: Mesh, uvmap: str) -> np.ndarray | None:
+    """
+    Compute the MikkTSpace tangents of every corner of a Mesh.
+    :param mesh: Mesh to compute the tangents of, it must only have triangles and quads.
+    :param uvmap: Name of the UV Map the tangents follow.
+    :return: Array of shape (num_loops, 4) with the tangent and the bitangent sign of each corner, or None if the Mesh
+        has ngons.
+    """
+    num_loops = len(mesh.loops)
+    try:
+        mesh.calc_tangents(uvmap=uvmap)
+    except RuntimeError:
+        return None
+    try:
+        tangents = np.empty((num_loops, 4), dtype=np.single)
+        tangent_xyz = np.empty(num_loops * 3, dtype=np.single)
+        mesh.loops.foreach_get("tangent", tangent_xyz)
+        tangents[:, :3] = tangent_xyz.reshape(num_loops, 3)
+        bitangent_sign = np.empty(num_loops, dtype=np.single)
+        mesh.loops.foreach_get("bitangent_sign", bitangent_sign)
+        tangents[:, 3] = bitangent_sign
+    finally:
+        mesh.free_tangents()
+    stats.count("tangents_computed")
+    return tangents
+
+
+# Objects are assigned to a mesh and submesh of the model by the "major.minor" number in their name, such as "Top 0.1".
+SUBMESH_PATTERN = re.compile(r"(?P<major>\d{1,2})\.(?P<minor>\d{1,5})")
+
+
+def submesh_index(name: str) -> tuple[int, int] | None:
+    """
+    Get the mesh and submesh numbers of an Object from its name.
+    :param name: Object name.
+    :return: (major, minor), or None if the name has no number.
+    """
+    matching = SUBMESH_PATTERN.search(name)
+    if matching is None:
+        return None
+    return int(matching.group("major")), int(matching.group("minor"))
+
+
+def with_submesh_index(name: str, major: int, minor: int) -> str:
+    """
+    Get `name` with its "major.minor" number replaced, or added to the end if it has none.
+    """
+    matching = SUBMESH_PATTERN.search(name)
+    if matching is None:
+        return f"{name} {major}.{minor}"
+    return f"{name[:matching.start()]}{major}.{minor}{name[matching.end():]}"
+
+
+# `foreach_get`/`foreach_set` property, dtype and number of components of each Attribute data type.
+ATTRIBUTE_LAYOUT = {
+    'FLOAT': ("value", np.single, 1),
+    'INT': ("value", np.intc, 1),
+    'FLOAT_VECTOR': ("vector", np.single, 3),
+    'FLOAT_COLOR': ("color", np.single, 4),
+    # the sRGB bytes as they are stored, going through the linear "color" may not round trip exactly
+    'BYTE_COLOR': ("color_srgb", np.single, 4),
+    'BOOLEAN': ("value", np.bool_, 1),
+    'FLOAT2': ("vector", np.single, 2),
+    'INT8': ("value", np.intc, 1),
+    'INT32_2D': ("value", np.intc, 2),
+    'QUATERNION': ("value", np.single, 4),
+}
+
+
+# Exporters triangulate every face themselves on every export, evaluating the Shape Keys and split normals again as
+# they do. Triangulating once beforehand gives them meshes they can write as they are.
+TRIANGULATE_SOURCE_CORNER = ".triangulate_source_corner"
+
+
+def triangulate_object(obj: Object) -> bool:
+    """
+    Triangulate every face of the Object's Mesh in place, the same way the exporters would.
+
+    Quads are split between their first and third corners, like Blender's own tessellation that the glTF exporter
+    writes, and ngons are filled and beautified like it does. Triangulating adds no Vertices, so Shape Keys and Vertex
+    Group weights keep their data by Vertex index. Custom normals are stored relative to each corner's normal space,
+    which the new diagonals change, so they are read before and set again on the corners they came from afterwards.
+    Objects with enabled Modifiers other than Armatures are skipped, since Modifiers such as Subdivision Surface give
+    different results on triangles.
+    :param obj: Mesh Object to triangulate.
+    :return: True if the Mesh was changed.
+    """
+    mesh = obj.data
+    if len(mesh.loops) == 3 * len(mesh.polygons):
+        return False
+    if any(mod.show_viewport and mod.type != 'ARMATURE' for mod in obj.modifiers):
+        return False
+
+    num_loops = len(mesh.loops)
+    custom_normals = None
+    if mesh.has_custom_normals:
+        custom_normals = np.empty(num_loops * 3, dtype=np.single)
+        mesh.corner_normals.foreach_get("vector", custom_normals)
+        # bmesh copies corner data onto the corners of the new triangles, so this tells where each one came from
+        source_attribute = mesh.attributes.new(TRIANGULATE_SOURCE_CORNER, 'INT', 'CORNER')
+        source_attribute.data.foreach_set("value", np.arange(num_loops, dtype=np.intc))
+
+    bm = bmesh.new()
+    try:
+        bm.from_mesh(mesh)
+        bmesh.ops.triangulate(bm, faces=[f for f in bm.faces if len(f.verts) > 3],
+                              quad_method='FIXED', ngon_method='BEAUTY')
+        bm.to_mesh(mesh)
+    finally:
+        bm.free()
+
+    if custom_normals is not None:
+        source_attribute = mesh.attributes[TRIANGULATE_SOURCE_CORNER]
+        source_corner = np.empty(len(mesh.loops), dtype=np.intc)
+        source_attribute.data.foreach_get("value", source_corner)
+        mesh.attributes.remove(source_attribute)
+        mesh.normals_split_custom_set(custom_normals.reshape(num_loops, 3)[source_corner])
+    stats.count("meshes_triangulated")
+    return True
+
+
+# Applies many Shape Keys to the Reference Key at once. Applying them one at a time with `apply_new_reference_key`
+# reads and writes every Shape Key relative to the Reference Key once per applied Shape Key, which is O(K²·N). Here
+# the scaled differences of all the applied Shape Keys are summed first, then every remaining Shape Key is read and
+# written exactly once.
+def apply_shape_keys_to_reference_key(obj: Object, key_blocks_to_apply: list[ShapeKey]) -> bool:
+    """
+    Apply every Shape Key in `key_blocks_to_apply` to the Reference Key at its current strength and remove it.
+
+    Only the typical setup is handled: every Shape Key being applied must be directly relative to the Reference Key
+    and no remaining Shape Key may be relative to a Shape Key being applied. Otherwise nothing is changed and False is
+    returned so the caller can fall back to applying the Shape Keys one at a time.
+    :param obj: Mesh Object the Shape Keys belong to.
+    :param key_blocks_to_apply: Shape Keys to apply and then remove. Must not contain the Reference Key.
+    :return: True if the Shape Keys were applied and removed.
+    """
+    mesh = cast(Mesh, obj.data)
+    shape_keys = mesh.shape_keys
+    if not shape_keys or not key_blocks_to_apply:
+        return False
+
+    reference_key = shape_keys.reference_key
+    to_apply = set(key_blocks_to_apply)
+    if reference_key in to_apply or not shape_keys.use_relative:
+        return False
+
+    for key_block in key_blocks_to_apply:
+        if key_block.relative_key != reference_key:
+            return False
+
+    remaining = [key_block for key_block in shape_keys.key_blocks if key_block not in to_apply]
+    if any(key_block.relative_key in to_apply for key_block in remaining):
+        return False
+
+    # Only Shape Keys recursively relative to the Reference Key move along with it. A Shape Key relative to itself (or
+    # to a loop of other Shape Keys) keeps its absolute coordinates, the same as when applying one at a time.
+    reverse_relative_map = {}
+    for key_block in remaining:
+        if key_block == reference_key:
+            continue
+        reverse_relative_map.setdefault(key_block.relative_key, []).append(key_block)
+    keys_to_offset = [reference_key]
+    checked = {reference_key}
+    for key_block in keys_to_offset:
+        for relative_to_key in reverse_relative_map.get(key_block, ()):
+            if relative_to_key not in checked:
+                checked.add(relative_to_key)
+                keys_to_offset.append(relative_to_key)
+
+    num_verts = len(mesh.vertices)
+    flat_co_length = num_verts * 3
+
+    reference_co_flat = np.empty(flat_co_length, dtype=np.single)
+    fast_mesh_shape_key_co_foreach_get(reference_key, reference_co_flat)
+
+    # All the applied Shape Keys are relative to the unchanged Reference Key, so each one's difference is independent of
+    # the order they are applied in. Shape Keys usually only move a few Vertices, so the differences are kept sparse.
+    temp_co_array = np.empty(flat_co_length, dtype=np.single)
+    differences = []
+    for key_block in key_blocks_to_apply:
+        value = key_block.value
+        if value == 0.0:
+            # 0.0 would have no effect, so set to 1.0, matching `apply_new_reference_key`.
+            value = 1.0
+        difference = SparseDelta.from_shape_key(key_block, reference_co_flat, temp_co_array=temp_co_array).scale(value)
+
+        vertex_group = obj.vertex_groups.get(key_block.vertex_group) if key_block.vertex_group else None
+        if vertex_group:
+            difference = difference.scale(vertex_weights(mesh).column(vertex_group.index)).prune()
+
+        differences.append(difference)
+
+    total_difference = SparseDelta.sum(num_verts, differences)
+    del differences
+
+    # The Reference Key coordinates have already been acquired, so it can be done separately to save a #foreach_get.
+    total_difference.add_to(reference_co_flat)
+    fast_mesh_shape_key_co_foreach_set(reference_key, reference_co_flat)
+    for key_block in keys_to_offset[1:]:
+        fast_mesh_shape_key_co_add_sparse(key_block, total_difference, temp_co_array)
+
+    for key_block in key_blocks_to_apply:
+        obj.shape_key_remove(key_block)
+
+    set_mesh_vertex_co(mesh, reference_co_flat)
+    return True
\ No newline at end of file
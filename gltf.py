@@ -0,0 +1,516 @@
+'''
+glTF/GLB writer for the subset of glTF Penumbra reads from FFXIV models.
+
+Meshes are written with positions, normals, tangents, UVs, one colour set, joints/weights and morph targets (with
+their names in the mesh extras, like the stock exporter), armatures as a skin, materials by name only and custom
+properties as extras. Every buffer is built straight from foreach_get arrays and written with a single write.
+'''
+
+import bpy
+import json
+import os
+import struct
+from contextlib import contextmanager
+
+import numpy as np
+from mathutils import Matrix
+
+from . import cache, stats
+from .functions import fast_mesh_shape_key_co_foreach_get, get_mesh_vertex_co, unique_rows, vertex_weights
+from .staging import SceneIndex
+
+# Blender is Z up, glTF is Y up: (x, y, z) -> (x, z, -y)
+AXIS_CONVERSION = Matrix(((1.0, 0.0, 0.0, 0.0),
+                          (0.0, 0.0, 1.0, 0.0),
+                          (0.0, -1.0, 0.0, 0.0),
+                          (0.0, 0.0, 0.0, 1.0)))
+AXIS_CONVERSION_INVERTED = AXIS_CONVERSION.inverted()
+# Applied to row vectors, (N, 3) @ AXIS_ROWS converts a whole array
+AXIS_ROWS = np.array(AXIS_CONVERSION.to_3x3(), dtype=np.single).T
+
+# glTF constants
+FLOAT = 5126
+UNSIGNED_BYTE = 5121
+UNSIGNED_SHORT = 5123
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+TYPES = {1: "SCALAR", 2: "VEC2", 3: "VEC3", 4: "VEC4", 16: "MAT4"}
+COMPONENT_TYPES = {np.dtype(np.single): FLOAT, np.dtype(np.uint8): UNSIGNED_BYTE,
+                   np.dtype(np.uint16): UNSIGNED_SHORT, np.dtype(np.uint32): UNSIGNED_INT}
+
+GLB_MAGIC = 0x46546C67
+GLB_JSON = 0x4E4F534A
+GLB_BIN = 0x004E4942
+
+# Joints and weights per vertex, the stock exporter also limits to one set of 4
+MAX_INFLUENCES = 4
+
+
+class BufferBuilder:
+    ''' Collects arrays as accessors and packs them into one binary buffer '''
+    __slots__ = 'arrays', 'buffer_views', 'accessors', 'byte_length'
+
+    def __init__(self):
+        self.arrays = []
+        self.buffer_views = []
+        self.accessors = []
+        self.byte_length = 0
+
+    def add(self, arr, target=None, min_max=False, normalized=False):
+        ''' arr is (count, components) or (count,), returns the accessor index '''
+        arr = np.ascontiguousarray(arr)
+        count = arr.shape[0]
+        components = 1 if arr.ndim == 1 else arr.shape[1]
+        # every buffer view starts 4 byte aligned
+        offset = (self.byte_length + 3) & ~3
+        self.arrays.append((offset, arr))
+        view = {"buffer": 0, "byteOffset": offset, "byteLength": arr.nbytes}
+        if target is not None:
+            view["target"] = target
+        self.buffer_views.append(view)
+        self.byte_length = offset + arr.nbytes
+
+        accessor = {
+            "bufferView": len(self.buffer_views) - 1,
+            "componentType": COMPONENT_TYPES[arr.dtype],
+            "count": count,
+            "type": TYPES[components],
+        }
+        if normalized:
+            accessor["normalized"] = True
+        if min_max and count:
+            reshaped = arr.reshape(count, components)
+            accessor["min"] = reshaped.min(axis=0).tolist()
+            accessor["max"] = reshaped.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def to_bytes(self):
+        ''' Copies every array into one preallocated buffer '''
+        data = bytearray((self.byte_length + 3) & ~3)
+        view = memoryview(data)
+        for offset, arr in self.arrays:
+            view[offset:offset + arr.nbytes] = arr.reshape(-1).view(np.uint8)
+        return data
+
+
+def to_json_value(value):
+    ''' Custom property value as something json can write, None if it can't be written '''
+    if hasattr(value, "to_dict"):
+        value = value.to_dict()
+    elif hasattr(value, "to_list"):
+        value = value.to_list()
+    try:
+        json.dumps(value)
+    except (TypeError, ValueError):
+        return None
+    return value
+
+
+def custom_properties(id_data):
+    extras = {}
+    for key in id_data.keys():
+        # internal add-on data, the stock exporter skips these too
+        if key.startswith("_") or key in ("cycles", "cycles_visibility"):
+            continue
+        value = to_json_value(id_data[key])
+        if value is not None:
+            extras[key] = value
+    return extras
+
+
+def trs(matrix):
+    ''' Node transform of a Blender world or local matrix already converted to Y up '''
+    translation, rotation, scale = matrix.decompose()
+    node = {}
+    if translation.length_squared > 0.0:
+        node["translation"] = list(translation)
+    if rotation != rotation.__class__():
+        node["rotation"] = [rotation.x, rotation.y, rotation.z, rotation.w]
+    if scale != scale.__class__((1.0, 1.0, 1.0)):
+        node["scale"] = list(scale)
+    return node
+
+
+def convert_matrix(matrix):
+    return AXIS_CONVERSION @ matrix @ AXIS_CONVERSION_INVERTED
+
+
+def has_applied_modifiers(obj):
+    return any(mod.show_viewport and mod.type != 'ARMATURE' for mod in obj.modifiers)
+
+
+def baked_objects(objects, apply_modifiers):
+    ''' The mesh objects exported_mesh evaluates, their armature modifiers have to be off while it does '''
+    if not apply_modifiers:
+        return []
+    return [obj for obj in objects if obj.type == 'MESH' and has_applied_modifiers(obj)]
+
+
+def skin_weights(obj, mesh, joint_names):
+    ''' Top MAX_INFLUENCES joints and normalized weights per vertex from the CSR vertex group weights '''
+    num_verts = len(mesh.vertices)
+    joint_index = {name: i for i, name in enumerate(joint_names)}
+    group_to_joint = np.array([joint_index.get(group.name, -1) for group in obj.vertex_groups] or [-1], dtype=np.intc)
+
+    weights = vertex_weights(mesh)
+    rows = np.repeat(np.arange(num_verts, dtype=np.intc), np.diff(weights.indptr))
+    joints = group_to_joint[weights.indices] if len(weights.indices) else weights.indices
+    values = weights.data
+    keep = (joints >= 0) & (values > 0.0)
+    rows, joints, values = rows[keep], joints[keep], values[keep]
+
+    # heaviest influences first within each vertex
+    order = np.lexsort((-values, rows))
+    rows, joints, values = rows[order], joints[order], values[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < MAX_INFLUENCES
+
+    joint_dtype = np.uint8 if len(joint_names) <= 256 else np.uint16
+    vertex_joints = np.zeros((num_verts, MAX_INFLUENCES), dtype=joint_dtype)
+    vertex_weights_out = np.zeros((num_verts, MAX_INFLUENCES), dtype=np.single)
+    vertex_joints[rows[keep], rank[keep]] = joints[keep]
+    vertex_weights_out[rows[keep], rank[keep]] = values[keep]
+
+    totals = vertex_weights_out.sum(axis=1)
+    weighted = totals > 0.0
+    vertex_weights_out[weighted] /= totals[weighted, None]
+    return vertex_joints, vertex_weights_out
+
+
+@contextmanager
+def exported_mesh(obj, depsgraph, apply_modifiers):
+    ''' Yields obj's mesh as it is exported and whether its shape keys are exported.
+    With modifiers other than the armature left to apply that is the evaluated mesh without the armature, and like with
+    the stock exporters its shape keys are dropped. The armature modifiers of such objects have to be switched off
+    beforehand, see SceneIndex.armatures_disabled '''
+    if not (apply_modifiers and has_applied_modifiers(obj)):
+        yield obj.data, True
+        return
+
+    eval_obj = obj.evaluated_get(depsgraph)
+    stats.count("depsgraph_evaluations")
+    try:
+        yield eval_obj.to_mesh(preserve_all_data_layers=True, depsgraph=depsgraph), False
+    finally:
+        eval_obj.to_mesh_clear()
+
+
+def mesh_arrays(obj, mesh, joint_names=None, world_space=False, use_shape_keys=True, use_tangent_cache=True,
+                stored_byte_colors=False):
+    ''' Arrays of every exported vertex of mesh in glTF's Y up space, which is also the space FFXIV models use.
+    Vertices are in world space when world_space is set, otherwise in obj's local space.
+    Joints and weights are only read when joint_names is given, joints index into joint_names.
+    Tangents of meshes exported before are reused from the cache unless use_tangent_cache is off.
+    Byte colours are linear like glTF wants, or the bytes as they are stored with stored_byte_colors '''
+    num_verts = len(mesh.vertices)
+    num_loops = len(mesh.loops)
+    mesh.calc_loop_triangles()
+    num_tris = len(mesh.loop_triangles)
+    tri_loops = np.empty(num_tris * 3, dtype=np.intc)
+    mesh.loop_triangles.foreach_get("loops", tri_loops)
+    tri_materials = np.empty(num_tris, dtype=np.intc)
+    mesh.loop_triangles.foreach_get("material_index", tri_materials)
+
+    corner_verts = np.empty(num_loops, dtype=np.intc)
+    mesh.loops.foreach_get("vertex_index", corner_verts)
+    vertex_co = np.empty(num_verts * 3, dtype=np.single)
+    get_mesh_vertex_co(mesh, vertex_co)
+    vertex_co = vertex_co.reshape(num_verts, 3)
+    normals = np.empty(num_loops * 3, dtype=np.single)
+    mesh.corner_normals.foreach_get("vector", normals)
+    normals = normals.reshape(num_loops, 3)
+
+    uvs = []
+    for uv_layer in mesh.uv_layers:
+        uv = np.empty(num_loops * 2, dtype=np.single)
+        uv_layer.uv.foreach_get("vector", uv)
+        uvs.append(uv.reshape(num_loops, 2))
+
+    color = None
+    color_index = mesh.color_attributes.render_color_index
+    if color_index >= 0:
+        color_attribute = mesh.color_attributes[color_index]
+        color = np.empty(len(color_attribute.data) * 4, dtype=np.single)
+        stored = stored_byte_colors and color_attribute.data_type == 'BYTE_COLOR'
+        color_attribute.data.foreach_get("color_srgb" if stored else "color", color)
+        color = color.reshape(-1, 4)
+        if color_attribute.domain == 'POINT':
+            color = color[corner_verts]
+
+    tangents = None
+    if mesh.uv_layers:
+        # only tris and quads can have tangents, ngons are left to the importer
+        tangents = cache.corner_tangents(mesh, vertex_co, corner_verts, normals, uvs[mesh.uv_layers.active_index],
+                                         use_cache=use_tangent_cache)
+
+    # every distinct combination of corner attributes is one exported vertex
+    columns = [corner_verts, normals] + uvs
+    if color is not None:
+        columns.append(color)
+    if tangents is not None:
+        columns.append(tangents)
+    first_corner, corner_to_vertex = unique_rows(columns)
+    exported_verts = corner_verts[first_corner]
+
+    if world_space:
+        world = obj.matrix_world
+        to_space = np.array(world.to_3x3(), dtype=np.single).T
+        normal_space = np.array(world.to_3x3().inverted_safe().transposed(), dtype=np.single).T
+        translation = np.array(world.translation, dtype=np.single)
+    else:
+        to_space = normal_space = np.identity(3, dtype=np.single)
+        translation = np.zeros(3, dtype=np.single)
+
+    def convert_vectors(vectors, space, normalize):
+        converted = vectors @ space @ AXIS_ROWS
+        if normalize:
+            lengths = np.linalg.norm(converted, axis=1, keepdims=True)
+            np.divide(converted, lengths, out=converted, where=lengths > 0.0)
+        return converted.astype(np.single)
+
+    base_normals = normals[first_corner]
+    arrays = {
+        "positions": ((vertex_co[exported_verts] @ to_space + translation) @ AXIS_ROWS).astype(np.single),
+        "normals": convert_vectors(base_normals, normal_space, True),
+        "tangents": None,
+        # glTF UVs start at the top left
+        "uvs": [np.column_stack((uv[first_corner, 0], 1.0 - uv[first_corner, 1])).astype(np.single) for uv in uvs],
+        "color": color[first_corner] if color is not None else None,
+        "joints": None,
+        "weights": None,
+        "triangles": corner_to_vertex[tri_loops].reshape(num_tris, 3),
+        "triangle_materials": tri_materials,
+        # (name, value, position offsets, normal offsets)
+        "shape_keys": [],
+    }
+    if tangents is not None:
+        arrays["tangents"] = np.column_stack((convert_vectors(tangents[first_corner, :3], to_space, True),
+                                              tangents[first_corner, 3])).astype(np.single)
+    if joint_names is not None:
+        joints, weights = skin_weights(obj, mesh, joint_names)
+        arrays["joints"] = joints[exported_verts]
+        arrays["weights"] = weights[exported_verts]
+
+    shape_keys = mesh.shape_keys if use_shape_keys else None
+    if shape_keys is not None and len(shape_keys.key_blocks) > 1:
+        reference_key = shape_keys.reference_key
+        reference_co = np.empty(num_verts * 3, dtype=np.single)
+        fast_mesh_shape_key_co_foreach_get(reference_key, reference_co)
+        key_co = np.empty(num_verts * 3, dtype=np.single)
+        for key_block in shape_keys.key_blocks:
+            if key_block == reference_key:
+                continue
+            fast_mesh_shape_key_co_foreach_get(key_block, key_co)
+            offsets = (key_co - reference_co).reshape(num_verts, 3)[exported_verts]
+            key_normals = np.array(key_block.normals_split_get(), dtype=np.single).reshape(num_loops, 3)
+            arrays["shape_keys"].append((key_block.name, key_block.value,
+                                         convert_vectors(offsets, to_space, False),
+                                         convert_vectors(key_normals[first_corner] - base_normals, normal_space, False)))
+    return arrays
+
+
+class GltfWriter:
+    def __init__(self, context, index, use_cache=True, export_extras=True):
+        self.context = context
+        self.index = index
+        self.use_cache = use_cache
+        self.export_extras = export_extras
+        self.depsgraph = context.evaluated_depsgraph_get()
+        self.buffer = BufferBuilder()
+        self.nodes = []
+        self.root_nodes = []
+        self.meshes = []
+        self.materials = []
+        self.material_index = {}
+        self.skins = []
+        # armature object -> (armature node, skin index, bone names)
+        self.armatures = {}
+
+    def extras(self, id_data):
+        ''' The custom properties of id_data to write as extras, none unless export_extras is set '''
+        return custom_properties(id_data) if self.export_extras else {}
+
+    def material(self, material):
+        if material is None:
+            return None
+        if material not in self.material_index:
+            entry = {"name": material.name, "doubleSided": not material.use_backface_culling}
+            extras = self.extras(material)
+            if extras:
+                entry["extras"] = extras
+            self.material_index[material] = len(self.materials)
+            self.materials.append(entry)
+        return self.material_index[material]
+
+    def add_armature(self, arm):
+        if arm in self.armatures:
+            return self.armatures[arm]
+
+        arm_world = convert_matrix(arm.matrix_world)
+        arm_node = len(self.nodes)
+        node = dict(name=arm.name, **trs(arm_world))
+        extras = self.extras(arm)
+        if extras:
+            node["extras"] = extras
+        self.nodes.append(node)
+        self.root_nodes.append(arm_node)
+
+        bones = list(arm.data.bones)
+        bone_nodes = {}
+        bone_worlds = {}
+        for bone in bones:
+            bone_worlds[bone.name] = convert_matrix(arm.matrix_world @ bone.matrix_local)
+            bone_nodes[bone.name] = len(self.nodes)
+            self.nodes.append({"name": bone.name})
+
+        for bone in bones:
+            parent_world = bone_worlds[bone.parent.name] if bone.parent else arm_world
+            self.nodes[bone_nodes[bone.name]].update(trs(parent_world.inverted() @ bone_worlds[bone.name]))
+            children = [bone_nodes[child.name] for child in bone.children]
+            if children:
+                self.nodes[bone_nodes[bone.name]]["children"] = children
+        node["children"] = [bone_nodes[bone.name] for bone in bones if bone.parent is None]
+
+        # skinned vertices are written in world space, so the bind matrices only undo the joints
+        inverse_bind = np.array([np.array(bone_worlds[bone.name].inverted(), dtype=np.single).T.reshape(16)
+                                 for bone in bones], dtype=np.single).reshape(len(bones), 16)
+        skin = {
+            "joints": [bone_nodes[bone.name] for bone in bones],
+            "skeleton": arm_node,
+            "name": arm.name,
+        }
+        if bones:
+            skin["inverseBindMatrices"] = self.buffer.add(inverse_bind)
+        self.skins.append(skin)
+        result = (arm_node, len(self.skins) - 1, [bone.name for bone in bones])
+        self.armatures[arm] = result
+        return result
+
+    def add_mesh_object(self, obj, apply_modifiers):
+        arm = self.index.armature_of(obj)
+        skin = self.add_armature(arm) if arm is not None else None
+
+        with exported_mesh(obj, self.depsgraph, apply_modifiers) as (mesh, use_shape_keys):
+            # skinned meshes are written in world space with an identity node
+            arrays = mesh_arrays(obj, mesh,
+                                 joint_names=skin[2] if skin is not None else None,
+                                 world_space=skin is not None,
+                                 use_shape_keys=use_shape_keys,
+                                 use_tangent_cache=self.use_cache)
+            materials = [self.material(material) for material in mesh.materials]
+
+        self.meshes.append(self.mesh_data(obj, arrays, materials))
+        node = {"name": obj.name, "mesh": len(self.meshes) - 1}
+        if skin is not None:
+            node["skin"] = skin[1]
+        else:
+            node.update(trs(convert_matrix(obj.matrix_world)))
+        extras = self.extras(obj)
+        if extras:
+            node["extras"] = extras
+        self.root_nodes.append(len(self.nodes))
+        self.nodes.append(node)
+
+    def mesh_data(self, obj, arrays, materials):
+        attributes = {
+            "POSITION": self.buffer.add(arrays["positions"], ARRAY_BUFFER, min_max=True),
+            "NORMAL": self.buffer.add(arrays["normals"], ARRAY_BUFFER),
+        }
+        if arrays["tangents"] is not None:
+            attributes["TANGENT"] = self.buffer.add(arrays["tangents"], ARRAY_BUFFER)
+        for i, uv in enumerate(arrays["uvs"]):
+            attributes[f"TEXCOORD_{i}"] = self.buffer.add(uv, ARRAY_BUFFER)
+        if arrays["color"] is not None:
+            attributes["COLOR_0"] = self.buffer.add(arrays["color"], ARRAY_BUFFER)
+        if arrays["joints"] is not None:
+            attributes["JOINTS_0"] = self.buffer.add(arrays["joints"], ARRAY_BUFFER)
+            attributes["WEIGHTS_0"] = self.buffer.add(arrays["weights"], ARRAY_BUFFER)
+
+        targets = []
+        for _, _, offsets, normal_offsets in arrays["shape_keys"]:
+            targets.append({
+                "POSITION": self.buffer.add(offsets, ARRAY_BUFFER, min_max=True),
+                "NORMAL": self.buffer.add(normal_offsets, ARRAY_BUFFER),
+            })
+
+        primitives = []
+        index_dtype = np.uint16 if len(arrays["positions"]) <= 65535 else np.uint32
+        triangles, triangle_materials = arrays["triangles"], arrays["triangle_materials"]
+        for material_index in np.unique(triangle_materials):
+            indices = triangles[triangle_materials == material_index].reshape(-1).astype(index_dtype)
+            primitive = {"attributes": attributes, "indices": self.buffer.add(indices, ELEMENT_ARRAY_BUFFER), "mode": 4}
+            material = materials[material_index] if material_index < len(materials) else None
+            if material is not None:
+                primitive["material"] = material
+            if targets:
+                primitive["targets"] = targets
+            primitives.append(primitive)
+
+        mesh_entry = {"name": obj.data.name, "primitives": primitives}
+        extras = self.extras(obj.data)
+        if targets:
+            mesh_entry["weights"] = [value for _, value, _, _ in arrays["shape_keys"]]
+            extras["targetNames"] = [name for name, _, _, _ in arrays["shape_keys"]]
+        if extras:
+            mesh_entry["extras"] = extras
+        return mesh_entry
+
+    def document(self):
+        gltf = {
+            "asset": {"version": "2.0", "generator": "Final Fantasy 14: A File Handler Reborn"},
+            "scene": 0,
+            "scenes": [{"name": self.context.scene.name, "nodes": self.root_nodes}],
+            "nodes": self.nodes,
+            "meshes": self.meshes,
+            "accessors": self.buffer.accessors,
+            "bufferViews": self.buffer.buffer_views,
+            "buffers": [{"byteLength": (self.buffer.byte_length + 3) & ~3}],
+        }
+        if self.materials:
+            gltf["materials"] = self.materials
+        if self.skins:
+            gltf["skins"] = self.skins
+        return gltf
+
+
+def write_gltf(context, filepath, objects, binary=True, apply_modifiers=True, use_cache=True, export_extras=True):
+    ''' Writes the mesh objects (and the armatures they are skinned to) as .glb, or .gltf with a .bin next to it.
+    Tangents are reused from the cache for meshes that haven't changed when use_cache is set, custom properties are
+    written as extras when export_extras is set. Returns the number of bytes written '''
+    index = SceneIndex(objects)
+    writer = GltfWriter(context, index, use_cache, export_extras)
+    with index.armatures_disabled(baked_objects(objects, apply_modifiers), writer.depsgraph):
+        for obj in objects:
+            if obj.type == 'MESH':
+                writer.add_mesh_object(obj, apply_modifiers)
+    for obj in objects:
+        # armatures nothing is skinned to are still written, like with use_selection in the stock exporter
+        if obj.type == 'ARMATURE':
+            writer.add_armature(obj)
+
+    gltf = writer.document()
+    binary_data = writer.buffer.to_bytes()
+
+    if binary:
+        json_data = json.dumps(gltf, separators=(',', ':')).encode()
+        json_data += b' ' * (-len(json_data) % 4)
+        length = 12 + 8 + len(json_data) + 8 + len(binary_data)
+        data = b"".join((
+            struct.pack("<III", GLB_MAGIC, 2, length),
+            struct.pack("<II", len(json_data), GLB_JSON), json_data,
+            struct.pack("<II", len(binary_data), GLB_BIN), binary_data,
+        ))
+        with open(filepath, 'wb') as f:
+            f.write(data)
+        return len(data)
+
+    bin_path = os.path.splitext(filepath)[0] + ".bin"
+    gltf["buffers"][0]["uri"] = os.path.basename(bin_path)
+    json_data = json.dumps(gltf, indent=2).encode()
+    with open(bin_path, 'wb') as f:
+        f.write(binary_data)
+    with open(filepath, 'wb') as f:
+        f.write(json_data)
+    return len(json_data) + len(binary_data)
@@ -0,0 +1,93 @@
+'''
+Writes FFXIV .mdl models (version 5, one LoD) directly, without converting a .fbx or .gltf in another tool.
+
+Objects are grouped into meshes and submeshes by the "major.minor" number in their name, the same numbering the
+widget counts vertices with. Every mesh gets its material from its first object. The packing itself is in
+mdl_format.py, which doesn't need Blender.
+'''
+
+import numpy as np
+
+from .functions import submesh_index
+from .gltf import baked_objects, exported_mesh, mesh_arrays
+from .mdl_format import pack_mdl
+from .staging import SceneIndex
+
+
+def object_attributes(obj):
+    ''' FFXIV attributes are custom properties named atr_* that are turned on '''
+    return sorted(key for key in obj.keys() if key.startswith("atr_") and obj[key])
+
+
+def material_name(obj):
+    for slot in obj.material_slots:
+        if slot.material is not None:
+            name = slot.material.name
+            return name if name.startswith("/") else "/" + name
+    return "/mt_default.mtrl"
+
+
+def collect_meshes(context, objects, apply_modifiers=True, use_cache=True):
+    ''' Reads the mesh objects into the meshes and bone names pack_mdl takes '''
+    depsgraph = context.evaluated_depsgraph_get()
+    mesh_objects = [obj for obj in objects if obj.type == 'MESH']
+    index = SceneIndex(mesh_objects)
+
+    armature_bones = []
+    for obj in mesh_objects:
+        arm = index.armature_of(obj)
+        if arm is not None:
+            armature_bones += [bone.name for bone in arm.data.bones]
+    joint_names = list(dict.fromkeys(armature_bones))
+
+    # objects without a number go after the numbered meshes, one mesh each
+    numbered = sorted((key, obj.name, obj) for obj in mesh_objects if (key := submesh_index(obj.name)) is not None)
+    groups = {}
+    for (major, _), _, obj in numbered:
+        groups.setdefault(major, []).append(obj)
+    grouped = [groups[major] for major in sorted(groups)]
+    grouped += [[obj] for obj in mesh_objects if submesh_index(obj.name) is None]
+
+    meshes = []
+    with index.armatures_disabled(baked_objects(mesh_objects, apply_modifiers), depsgraph):
+        for group in grouped:
+            submeshes = []
+            for obj in group:
+                skinned = index.armature_of(obj) is not None
+                with exported_mesh(obj, depsgraph, apply_modifiers) as (mesh, use_shape_keys):
+                    arrays = mesh_arrays(obj, mesh, joint_names=joint_names if skinned else None,
+                                         world_space=True, use_shape_keys=use_shape_keys,
+                                         use_tangent_cache=use_cache,
+                                         # FFXIV reads the colour bytes as shader masks, they're written unchanged
+                                         stored_byte_colors=True)
+                arrays["attributes"] = object_attributes(obj)
+                arrays["shapes"] = [(name, offsets, normal_offsets)
+                                    for name, _, offsets, normal_offsets in arrays["shape_keys"]]
+                submeshes.append(arrays)
+            meshes.append({"material": material_name(group[0]), "submeshes": submeshes})
+
+    # only bones something is weighted to are written
+    used = np.zeros(len(joint_names), dtype=bool)
+    for mesh in meshes:
+        for sub in mesh["submeshes"]:
+            if sub["joints"] is not None:
+                used[sub["joints"][sub["weights"] > 0.0]] = True
+    remap = np.cumsum(used) - 1
+    for mesh in meshes:
+        for sub in mesh["submeshes"]:
+            if sub["joints"] is not None:
+                sub["joints"] = np.where(sub["weights"] > 0.0, remap[sub["joints"]], 0)
+    bone_names = [name for name, is_used in zip(joint_names, used) if is_used]
+    return meshes, bone_names
+
+
+def write_mdl(context, filepath, objects, apply_modifiers=True, use_cache=True):
+    ''' Writes the mesh objects as an FFXIV .mdl. Returns the number of bytes written, raises ValueError when the
+    model is over the game's limits '''
+    meshes, bone_names = collect_meshes(context, objects, apply_modifiers, use_cache)
+    if not meshes:
+        raise ValueError("There are no meshes to export")
+    data = pack_mdl(meshes, bone_names)
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    return len(data)
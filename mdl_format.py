@@ -0,0 +1,449 @@
+'''
+Packs and reads FFXIV .mdl models (version 5, one LoD).
+
+Every mesh gets a bone table of the bones its vertices use and its own vertex declaration. Shape keys become shapes:
+every vertex a shape key moves is added to the end of the mesh's vertices and the shape replaces the indices that use
+it.
+
+This module only works on numpy arrays and imports nothing from Blender, so a written model can be read back and
+checked outside of it. mdl.py reads the objects into the arrays pack_mdl takes.
+'''
+
+import struct
+
+import numpy as np
+
+MDL_VERSION = 0x01000005
+LOD_COUNT = 3
+# Limits of the ushort vertex counts and 64 entry bone tables
+MAX_MESH_VERTICES = 65535
+MAX_BONE_TABLE = 64
+# Each mesh's indices start 16 byte aligned
+INDEX_ALIGNMENT = 8
+
+VERTEX_ELEMENT_COUNT = 17
+VERTEX_ELEMENT = struct.Struct("<BBBBB3x")
+
+# Vertex element types
+SINGLE2 = 1
+SINGLE3 = 2
+SINGLE4 = 3
+UBYTE4 = 5
+NBYTE4 = 8
+
+# Vertex element usages
+POSITION = 0
+BLEND_WEIGHTS = 1
+BLEND_INDICES = 2
+NORMAL = 3
+UV = 4
+TANGENT1 = 6
+COLOR = 7
+
+FILE_HEADER = struct.Struct("<IIIHH3I3I3I3IBBBx")
+MODEL_HEADER = struct.Struct("<f9HBBHBBffHHBBBBHHH6x")
+LOD = struct.Struct("<HHff8H8I")
+MESH = struct.Struct("<HxxIHHHHI3I3BB")
+SUBMESH = struct.Struct("<IIIHH")
+BONE_TABLE = struct.Struct(f"<{MAX_BONE_TABLE}HB3x")
+SHAPE = struct.Struct("<I3H3H")
+SHAPE_MESH = struct.Struct("<III")
+SHAPE_VALUE = np.dtype([("base_index", "<u2"), ("replacing_vertex", "<u2")])
+BOUNDING_BOX = struct.Struct("<8f")
+
+def to_nbyte(values):
+    ''' Normalized [0, 1] floats as bytes '''
+    return np.clip(np.rint(values * 255.0), 0, 255).astype(np.uint8)
+
+
+def stream_layouts(skinned, uv_width):
+    ''' Vertex elements (stream, offset, type, usage, usage index) and the numpy dtype of both vertex streams '''
+    elements = [(0, 0, SINGLE3, POSITION, 0)]
+    fields0 = [("position", "<f4", (3,))]
+    if skinned:
+        elements += [(0, 12, NBYTE4, BLEND_WEIGHTS, 0), (0, 16, UBYTE4, BLEND_INDICES, 0)]
+        fields0 += [("blend_weights", "u1", (4,)), ("blend_indices", "u1", (4,))]
+    elements += [(1, 0, SINGLE3, NORMAL, 0), (1, 12, NBYTE4, TANGENT1, 0), (1, 16, NBYTE4, COLOR, 0),
+                 (1, 20, SINGLE4 if uv_width == 4 else SINGLE2, UV, 0)]
+    fields1 = [("normal", "<f4", (3,)), ("tangent", "u1", (4,)), ("color", "u1", (4,)), ("uv", "<f4", (uv_width,))]
+    return elements, np.dtype(fields0), np.dtype(fields1)
+
+
+def pack_declaration(elements):
+    data = bytearray(VERTEX_ELEMENT_COUNT * VERTEX_ELEMENT.size)
+    for i, element in enumerate(elements):
+        VERTEX_ELEMENT.pack_into(data, i * VERTEX_ELEMENT.size, *element)
+    VERTEX_ELEMENT.pack_into(data, len(elements) * VERTEX_ELEMENT.size, 0xFF, 0, 0, 0, 0)
+    return bytes(data)
+
+
+def merge_submeshes(submeshes):
+    ''' Concatenates the vertex arrays of a mesh's submeshes, returns the arrays and every submesh's indices '''
+    offsets = np.cumsum([0] + [len(sub["positions"]) for sub in submeshes])
+    uv_count = max(len(sub["uvs"]) for sub in submeshes)
+
+    def concat(key, width, default, dtype=np.single):
+        parts = []
+        for sub in submeshes:
+            value = sub.get(key)
+            if value is None:
+                value = np.full((len(sub["positions"]), width), default, dtype=dtype)
+            parts.append(value)
+        return np.concatenate(parts)
+
+    merged = {
+        "positions": concat("positions", 3, 0.0),
+        "normals": concat("normals", 3, 0.0),
+        "tangents": concat("tangents", 4, 0.0),
+        "color": concat("color", 4, 1.0),
+        "joints": concat("joints", 4, 0, np.intc),
+        "weights": concat("weights", 4, 0.0),
+        "uvs": [],
+    }
+    for i in range(uv_count):
+        merged["uvs"].append(np.concatenate([sub["uvs"][i] if i < len(sub["uvs"])
+                                             else np.zeros((len(sub["positions"]), 2), dtype=np.single)
+                                             for sub in submeshes]))
+
+    # shape name -> (position offsets, normal offsets) over the merged vertices
+    shapes = {}
+    for offset, sub in zip(offsets, submeshes):
+        for name, positions, normals in sub["shapes"]:
+            if name not in shapes:
+                shapes[name] = (np.zeros_like(merged["positions"]), np.zeros_like(merged["normals"]))
+            shapes[name][0][offset:offset + len(positions)] = positions
+            shapes[name][1][offset:offset + len(normals)] = normals
+    merged["shapes"] = shapes
+
+    submesh_indices = [(sub["triangles"].reshape(-1) + offset) for offset, sub in zip(offsets, submeshes)]
+    return merged, submesh_indices
+
+
+def add_shape_vertices(merged, indices):
+    ''' Appends every vertex a shape moves to the mesh's vertices.
+    Returns, per shape, the positions in indices the shape replaces and the vertex replacing each of them '''
+    shape_values = []
+    for name, (position_offsets, normal_offsets) in merged["shapes"].items():
+        moved = np.any(position_offsets != 0.0, axis=1) | np.any(normal_offsets != 0.0, axis=1)
+        moved_rows = np.flatnonzero(moved)
+        first_new = len(merged["positions"])
+        replacement = np.full(len(moved), -1, dtype=np.intc)
+        replacement[moved_rows] = np.arange(first_new, first_new + len(moved_rows), dtype=np.intc)
+
+        normals = merged["normals"][moved_rows] + normal_offsets[moved_rows]
+        lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+        np.divide(normals, lengths, out=normals, where=lengths > 0.0)
+        for key in ("tangents", "color", "joints", "weights"):
+            merged[key] = np.concatenate((merged[key], merged[key][moved_rows]))
+        merged["uvs"] = [np.concatenate((uv, uv[moved_rows])) for uv in merged["uvs"]]
+        merged["positions"] = np.concatenate((merged["positions"], merged["positions"][moved_rows] + position_offsets[moved_rows]))
+        merged["normals"] = np.concatenate((merged["normals"], normals))
+
+        base_indices = np.flatnonzero(moved[indices])
+        if len(base_indices):
+            shape_values.append((name, base_indices, replacement[indices[base_indices]]))
+    return shape_values
+
+
+def vertex_streams(merged, bone_table, skinned, uv_width):
+    ''' Packs the merged vertices into the two vertex streams '''
+    elements, dtype0, dtype1 = stream_layouts(skinned, uv_width)
+    count = len(merged["positions"])
+    stream0 = np.zeros(count, dtype=dtype0)
+    stream1 = np.zeros(count, dtype=dtype1)
+
+    stream0["position"] = merged["positions"]
+    if skinned:
+        weights = to_nbyte(merged["weights"])
+        # rounding can leave the bytes not summing to 255, the heaviest influence takes the difference
+        weights[:, 0] += (255 - weights.sum(axis=1, dtype=np.intc)).astype(np.uint8) * (weights.sum(axis=1) > 0)
+        stream0["blend_weights"] = weights
+        table_index = np.searchsorted(bone_table, merged["joints"])
+        stream0["blend_indices"] = np.where(merged["weights"] > 0.0, table_index, 0)
+
+    stream1["normal"] = merged["normals"]
+    # the game wants the bitangent, with the handedness as 0 or 1
+    tangents = merged["tangents"]
+    bitangents = np.cross(merged["normals"], tangents[:, :3]) * tangents[:, 3:4]
+    stream1["tangent"][:, :3] = to_nbyte((bitangents + 1.0) * 0.5)
+    stream1["tangent"][:, 3] = np.where(tangents[:, 3] > 0.0, 255, 0)
+    stream1["color"] = to_nbyte(merged["color"])
+    if merged["uvs"]:
+        stream1["uv"] = np.hstack(merged["uvs"][:uv_width // 2])
+    return elements, stream0, stream1
+
+
+def bounding_box(positions):
+    if len(positions) == 0:
+        return (0.0,) * 8
+    low, high = positions.min(axis=0), positions.max(axis=0)
+    return (*low, 1.0, *high, 1.0)
+
+
+def pack_mdl(meshes, bone_names):
+    '''
+    Packs a model into .mdl bytes.
+
+    meshes is a list of {"material": str, "submeshes": [...]}, every submesh a dict of per vertex arrays in game space
+    with the keys of gltf.mesh_arrays ("positions", "normals", "tangents", "uvs", "color", "joints", "weights",
+    "triangles"), "joints" indexing into bone_names, plus "attributes" (a list of names) and "shapes" (a list of
+    (name, position offsets, normal offsets)).
+    Raises ValueError when a mesh is over the vertex or bone limits.
+    '''
+    skinned = any(sub.get("joints") is not None for mesh in meshes for sub in mesh["submeshes"])
+    attributes = sorted({name for mesh in meshes for sub in mesh["submeshes"] for name in sub["attributes"]})
+    if len(attributes) > 32:
+        raise ValueError(f"{len(attributes)} attributes are used, a model can only have 32")
+    materials = list(dict.fromkeys(mesh["material"] for mesh in meshes))
+    shape_names = list(dict.fromkeys(name for mesh in meshes for sub in mesh["submeshes"] for name, _, _ in sub["shapes"]))
+
+    declarations = []
+    vertex_data = []
+    vertex_size = 0
+    index_data = []
+    index_count = 0
+    triangle_count = 0
+    mesh_structs = []
+    submesh_structs = []
+    submesh_bone_map = []
+    bone_tables = []
+    # shape name -> [(mesh start index, shape values)]
+    shape_meshes = {name: [] for name in shape_names}
+    all_positions = []
+    bone_positions = [[] for _ in bone_names]
+
+    for mesh_index, mesh in enumerate(meshes):
+        merged, submesh_indices = merge_submeshes(mesh["submeshes"])
+        indices = np.concatenate(submesh_indices).astype(np.intc)
+        base_vertex_count = len(merged["positions"])
+        shape_values = add_shape_vertices(merged, indices)
+        if len(merged["positions"]) > MAX_MESH_VERTICES:
+            raise ValueError(f"Mesh {mesh_index} has {len(merged['positions'])} vertices including "
+                             f"{len(merged['positions']) - base_vertex_count} shape vertices, "
+                             f"the limit is {MAX_MESH_VERTICES}")
+        if len(indices) > MAX_MESH_VERTICES and shape_values:
+            raise ValueError(f"Mesh {mesh_index} has {len(indices)} indices, shapes can only replace the first {MAX_MESH_VERTICES}")
+
+        bone_table = np.unique(merged["joints"][merged["weights"] > 0.0]) if skinned else np.empty(0, dtype=np.intc)
+        if len(bone_table) > MAX_BONE_TABLE:
+            raise ValueError(f"Mesh {mesh_index} uses {len(bone_table)} bones, the limit is {MAX_BONE_TABLE}")
+        if skinned:
+            bone_tables.append(bone_table)
+            for bone in bone_table:
+                influenced = np.any((merged["joints"] == bone) & (merged["weights"] > 0.0), axis=1)
+                bone_positions[bone].append(merged["positions"][influenced])
+
+        uv_width = 4 if len(merged["uvs"]) > 1 else 2
+        elements, stream0, stream1 = vertex_streams(merged, bone_table, skinned, uv_width)
+        declarations.append(pack_declaration(elements))
+        all_positions.append(merged["positions"][:base_vertex_count])
+
+        start_index = index_count
+        submesh_start = len(submesh_structs)
+        for sub, sub_indices in zip(mesh["submeshes"], submesh_indices):
+            mask = sum(1 << attributes.index(name) for name in sub["attributes"])
+            sub_bones = np.unique(sub["joints"][sub["weights"] > 0.0]) if sub.get("joints") is not None else []
+            submesh_structs.append((index_count, len(sub_indices), mask, len(submesh_bone_map), len(sub_bones)))
+            submesh_bone_map.extend(int(bone) for bone in sub_bones)
+            index_count += len(sub_indices)
+
+        triangle_count += len(indices) // 3
+        padding = -len(indices) % INDEX_ALIGNMENT
+        index_data.append(np.concatenate((indices, np.zeros(padding, dtype=np.intc))).astype("<u2"))
+        index_count += padding
+
+        mesh_structs.append((
+            len(merged["positions"]), len(indices), materials.index(mesh["material"]),
+            submesh_start, len(mesh["submeshes"]), mesh_index if skinned else 255, start_index,
+            vertex_size, vertex_size + stream0.nbytes, 0,
+            stream0.itemsize, stream1.itemsize, 0, 2,
+        ))
+        vertex_data += [stream0, stream1]
+        vertex_size += stream0.nbytes + stream1.nbytes
+
+        for name, base_indices, replacing in shape_values:
+            values = np.empty(len(base_indices), dtype=SHAPE_VALUE)
+            values["base_index"] = base_indices
+            values["replacing_vertex"] = replacing
+            shape_meshes[name].append((start_index, values))
+
+    # strings, in the order the game lists them
+    strings = attributes + bone_names + materials + shape_names
+    string_offsets = []
+    string_data = bytearray()
+    for string in strings:
+        string_offsets.append(len(string_data))
+        string_data += string.encode() + b'\0'
+    string_data += b'\0' * (-len(string_data) % 4)
+    offset_of = dict(zip(strings, string_offsets))
+
+    runtime = bytearray()
+    runtime += struct.pack("<HHI", len(strings), 0, len(string_data)) + string_data
+
+    shape_mesh_count = sum(len(entries) for entries in shape_meshes.values())
+    shape_value_count = sum(len(values) for entries in shape_meshes.values() for _, values in entries)
+    positions = np.concatenate(all_positions) if all_positions else np.zeros((0, 3), dtype=np.single)
+    box = bounding_box(positions)
+    radius = float(np.linalg.norm(np.maximum(np.abs(box[:3]), np.abs(box[4:7]))))
+    runtime += MODEL_HEADER.pack(
+        radius, len(meshes), len(attributes), len(submesh_structs), len(materials), len(bone_names), len(bone_tables),
+        len(shape_names), shape_mesh_count, shape_value_count,
+        1, 0, 0, 0, 0, 0.0, 0.0, 0, 0, 0, 0, 0, 0, 0, 0, 0,
+    )
+
+    # the lod offsets are only known once everything before the vertex data is, so they are patched in below
+    lods_at = len(runtime)
+    runtime += bytes(LOD.size * LOD_COUNT)
+    for mesh_struct in mesh_structs:
+        runtime += MESH.pack(*mesh_struct)
+    for name in attributes:
+        runtime += struct.pack("<I", offset_of[name])
+    for submesh_struct in submesh_structs:
+        runtime += SUBMESH.pack(*submesh_struct)
+    for name in materials:
+        runtime += struct.pack("<I", offset_of[name])
+    for name in bone_names:
+        runtime += struct.pack("<I", offset_of[name])
+    for bone_table in bone_tables:
+        runtime += BONE_TABLE.pack(*bone_table.tolist(), *[0] * (MAX_BONE_TABLE - len(bone_table)), len(bone_table))
+
+    shape_mesh_index = 0
+    for name in shape_names:
+        runtime += SHAPE.pack(offset_of[name], shape_mesh_index, 0, 0, len(shape_meshes[name]), 0, 0)
+        shape_mesh_index += len(shape_meshes[name])
+    shape_value_offset = 0
+    for name in shape_names:
+        for start_index, values in shape_meshes[name]:
+            runtime += SHAPE_MESH.pack(start_index, len(values), shape_value_offset)
+            shape_value_offset += len(values)
+    for name in shape_names:
+        for _, values in shape_meshes[name]:
+            runtime += values.tobytes()
+
+    runtime += struct.pack("<I", len(submesh_bone_map) * 2)
+    runtime += np.array(submesh_bone_map, dtype="<u2").tobytes()
+
+    stack = b"".join(declarations)
+    # the bounding boxes start 8 byte aligned in the file
+    padding = -(FILE_HEADER.size + len(stack) + len(runtime) + 1) % 8
+    runtime += struct.pack("<B", padding) + bytes(padding)
+
+    runtime += BOUNDING_BOX.pack(*box) * 2 + bytes(BOUNDING_BOX.size * 2)
+    for parts in bone_positions:
+        runtime += BOUNDING_BOX.pack(*bounding_box(np.concatenate(parts) if parts else positions[:0]))
+
+    vertex_offset = FILE_HEADER.size + len(stack) + len(runtime)
+    index_offset = vertex_offset + vertex_size
+    index_size = index_count * 2
+    LOD.pack_into(runtime, lods_at, 0, len(meshes), 0.0, 0.0, *[len(meshes), 0] * 4,
+                  0, 0, triangle_count, 0, vertex_size, index_size, vertex_offset, index_offset)
+    for lod in range(1, LOD_COUNT):
+        LOD.pack_into(runtime, lods_at + lod * LOD.size, len(meshes), 0, 0.0, 0.0, *[len(meshes), 0] * 4, *[0] * 8)
+
+    header = FILE_HEADER.pack(
+        MDL_VERSION, len(stack), len(runtime), len(meshes), len(materials),
+        vertex_offset, 0, 0, index_offset, 0, 0, vertex_size, 0, 0, index_size, 0, 0,
+        1, 1, 0,
+    )
+
+    data = bytearray(index_offset + index_size)
+    view = memoryview(data)
+    position = 0
+    for part in (header, stack, runtime):
+        view[position:position + len(part)] = part
+        position += len(part)
+    for arr in vertex_data + index_data:
+        view[position:position + arr.nbytes] = arr.reshape(-1).view(np.uint8)
+        position += arr.nbytes
+    return data
+
+
+def read_mdl(data):
+    '''
+    Reads what pack_mdl writes back: the strings, every mesh's material, submeshes, bone table, positions and
+    indices, and the shapes as {name: [(mesh start index, shape values)]}.
+    '''
+    header = FILE_HEADER.unpack_from(data, 0)
+    version, stack_size, runtime_size, declaration_count = header[:4]
+    if version != MDL_VERSION:
+        raise ValueError(f"Unsupported .mdl version {version:#x}")
+    vertex_offset, index_offset = header[5], header[8]
+
+    declarations = []
+    for i in range(declaration_count):
+        elements = []
+        for j in range(VERTEX_ELEMENT_COUNT):
+            element = VERTEX_ELEMENT.unpack_from(data, FILE_HEADER.size + (i * VERTEX_ELEMENT_COUNT + j) * VERTEX_ELEMENT.size)
+            if element[0] == 0xFF:
+                break
+            elements.append(element)
+        declarations.append(elements)
+
+    position = FILE_HEADER.size + stack_size
+    string_count, _, string_size = struct.unpack_from("<HHI", data, position)
+    position += 8
+    string_block = bytes(data[position:position + string_size])
+    position += string_size
+
+    def string_at(offset):
+        return string_block[offset:string_block.index(b'\0', offset)].decode()
+
+    model = MODEL_HEADER.unpack_from(data, position)
+    mesh_count, attribute_count, submesh_count, material_count, bone_count, bone_table_count, shape_count, \
+        shape_mesh_count, shape_value_count = model[1:10]
+    position += MODEL_HEADER.size + LOD.size * LOD_COUNT
+
+    def read_structs(layout, count):
+        nonlocal position
+        result = [layout.unpack_from(data, position + i * layout.size) for i in range(count)]
+        position += layout.size * count
+        return result
+
+    def read_names(count):
+        nonlocal position
+        offsets = struct.unpack_from(f"<{count}I", data, position)
+        position += 4 * count
+        return [string_at(offset) for offset in offsets]
+
+    mesh_structs = read_structs(MESH, mesh_count)
+    attributes = read_names(attribute_count)
+    submesh_structs = read_structs(SUBMESH, submesh_count)
+    materials = read_names(material_count)
+    bones = read_names(bone_count)
+    bone_tables = [table[:table[MAX_BONE_TABLE]] for table in read_structs(BONE_TABLE, bone_table_count)]
+    shape_structs = read_structs(SHAPE, shape_count)
+    shape_mesh_structs = read_structs(SHAPE_MESH, shape_mesh_count)
+    shape_values = np.frombuffer(data, dtype=SHAPE_VALUE, count=shape_value_count, offset=position)
+
+    indices = np.frombuffer(data, dtype="<u2", count=(len(data) - index_offset) // 2, offset=index_offset)
+    meshes = []
+    for i, (vertex_count, index_count, material_index, first_submesh, mesh_submesh_count, bone_table_index,
+            start_index, offset0, offset1, _, stride0, stride1, _, _) in enumerate(mesh_structs):
+
+        def element_bytes(usage, size):
+            stream, offset = next((element[0], element[1]) for element in declarations[i] if element[3] == usage)
+            stride = (stride0, stride1)[stream]
+            raw = np.frombuffer(data, dtype=np.uint8, count=vertex_count * stride,
+                                offset=vertex_offset + (offset0, offset1)[stream])
+            return raw.reshape(vertex_count, stride)[:, offset:offset + size].copy()
+
+        positions = element_bytes(POSITION, 12).view("<f4")
+        meshes.append({
+            "material": materials[material_index],
+            "bone_table": [bones[bone] for bone in bone_tables[bone_table_index]] if bone_table_index != 255 else [],
+            "positions": positions,
+            "colors": element_bytes(COLOR, 4),
+            "indices": indices[start_index:start_index + index_count],
+            "submeshes": [{
+                "indices": indices[index_start:index_start + count],
+                "attributes": [name for bit, name in enumerate(attributes) if mask & (1 << bit)],
+            } for index_start, count, mask, _, _ in submesh_structs[first_submesh:first_submesh + mesh_submesh_count]],
+        })
+
+    shapes = {}
+    for string_offset, start, _, _, count, _, _ in shape_structs:
+        shapes[string_at(string_offset)] = [
+            (mesh_index_offset, shape_values[value_offset:value_offset + value_count])
+            for mesh_index_offset, value_count, value_offset in shape_mesh_structs[start:start + count]
+        ]
+    return {"attributes": attributes, "bones": bones, "materials": materials, "meshes": meshes, "shapes": shapes}
@@ -0,0 +1,316 @@
+'''
+Splits submeshes that are over the game's 65535 vertex limit into more meshes before exporting.
+
+The vertices of a major number are counted like the widget counts them, split at seams and sharp edges with the shp
+keys on top. When a major is over the limit its objects are packed into as few majors as fit, objects that are over
+the limit on their own are broken into their connected parts first and parts that are still over the limit are cut
+into slices along their longest axis. Broken objects are rebuilt from their faces with bulk index gathers, shape keys,
+attributes and weights included.
+'''
+
+import bpy
+
+import numpy as np
+
+from . import stats
+from .functions import (
+    ATTRIBUTE_LAYOUT,
+    SparseDelta,
+    exported_vertex_sources,
+    fast_mesh_shape_key_co_foreach_get,
+    fast_mesh_shape_key_co_foreach_set,
+    get_mesh_vertex_co,
+    submesh_index,
+    vertex_weights,
+    with_submesh_index,
+)
+
+SUBMESH_LIMIT = 65535
+# Slices share the vertices on their cuts, which is not known until they are cut, so they are filled to less than
+# the limit, and to less again while a slice is still over it
+SLICE_FILL = 0.9
+
+
+def polygon_layout(mesh):
+    ''' Corner vertex and edge indices, and the first corner and corner count of every face '''
+    corner_verts = np.empty(len(mesh.loops), dtype=np.intc)
+    mesh.loops.foreach_get("vertex_index", corner_verts)
+    corner_edges = np.empty(len(mesh.loops), dtype=np.intc)
+    mesh.loops.foreach_get("edge_index", corner_edges)
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.intc)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.intc)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    return corner_verts, corner_edges, loop_starts, loop_totals
+
+
+def vertex_components(num_verts, corner_verts, loop_starts, loop_totals):
+    ''' Label of the connected part of every vertex, vertices sharing a face share a label '''
+    parent = np.arange(num_verts, dtype=np.intc)
+    # every corner is joined to the first corner of its face
+    first = np.repeat(corner_verts[loop_starts], loop_totals)
+    while True:
+        root_a, root_b = parent[corner_verts], parent[first]
+        if np.array_equal(root_a, root_b):
+            return parent
+        # hook the larger root under the smaller one, then shortcut until every vertex points at its root
+        np.minimum.at(parent, np.maximum(root_a, root_b), np.minimum(root_a, root_b))
+        while True:
+            grandparent = parent[parent]
+            if np.array_equal(grandparent, parent):
+                break
+            parent = grandparent
+
+
+def vertex_costs(obj, epsilon=0.0, union=False):
+    ''' Exported vertices every vertex costs, counted the same way as widget.count_object with split '''
+    mesh = obj.data
+    num_verts = len(mesh.vertices)
+    multiplicity = np.bincount(exported_vertex_sources(mesh), minlength=num_verts)
+    moved = np.zeros(num_verts, dtype=np.intc)
+    shape_keys = mesh.shape_keys
+    if shape_keys is not None:
+        reference_key = shape_keys.reference_key
+        reference_co = np.empty(num_verts * 3, dtype=np.single)
+        fast_mesh_shape_key_co_foreach_get(reference_key, reference_co)
+        co = np.empty_like(reference_co)
+        for shp in (shp for shp in shape_keys.key_blocks if shp != reference_key and 'shp' in shp.name.lower()):
+            indices = SparseDelta.from_shape_key(shp, reference_co, epsilon, temp_co_array=co).indices
+            if union:
+                moved[indices] = 1
+            else:
+                moved[indices] += 1
+    return multiplicity * (1 + moved)
+
+
+def polygon_units(mesh, costs, limit):
+    ''' Breaks a mesh into pieces that are each under limit.
+    Returns the piece of every face and the cost of every piece '''
+    num_verts = len(mesh.vertices)
+    corner_verts, _, loop_starts, loop_totals = polygon_layout(mesh)
+    labels = vertex_components(num_verts, corner_verts, loop_starts, loop_totals)
+    _, unit_of_polygon = np.unique(labels[corner_verts[loop_starts]], return_inverse=True)
+    unit_of_vertex = np.full(num_verts, -1, dtype=np.intc)
+    unit_of_vertex[corner_verts] = np.repeat(unit_of_polygon, loop_totals)
+    used = unit_of_vertex >= 0
+    unit_costs = np.bincount(unit_of_vertex[used], weights=costs[used])
+
+    oversize = np.flatnonzero(unit_costs > limit)
+    if len(oversize):
+        co = np.empty(num_verts * 3, dtype=np.single)
+        get_mesh_vertex_co(mesh, co)
+        centers = np.add.reduceat(co.reshape(-1, 3)[corner_verts], loop_starts, axis=0) / loop_totals[:, None]
+        polygon_of_corner = np.repeat(np.arange(len(loop_starts), dtype=np.intc), loop_totals)
+        next_unit = len(unit_costs)
+        for unit in oversize:
+            # faces are taken in order along the longest axis, a vertex is paid for by the first face using it
+            polygons = np.flatnonzero(unit_of_polygon == unit)
+            axis = np.argmax(np.ptp(centers[polygons], axis=0))
+            order = polygons[np.argsort(centers[polygons, axis], kind='stable')]
+            rank = np.empty(len(loop_starts), dtype=np.intc)
+            rank[order] = np.arange(len(order), dtype=np.intc)
+            corners = np.flatnonzero(unit_of_polygon[polygon_of_corner] == unit)
+            first_rank = np.full(num_verts, len(order), dtype=np.intc)
+            np.minimum.at(first_rank, corner_verts[corners], rank[polygon_of_corner[corners]])
+            verts = np.flatnonzero(first_rank < len(order))
+            rank_costs = np.bincount(first_rank[verts], weights=costs[verts], minlength=len(order))
+            corner_ranks = rank[polygon_of_corner[corners]]
+            fill = SLICE_FILL
+            while True:
+                slices = ((np.cumsum(rank_costs) - rank_costs) // (limit * fill)).astype(np.intc)
+                # the vertices on the cuts are paid for by both slices, which can take a slice back over limit
+                pairs = np.unique(corner_verts[corners].astype(np.int64) * len(order) + slices[corner_ranks])
+                slice_costs = np.bincount(pairs % len(order), weights=costs[pairs // len(order)])
+                if slice_costs.max() <= limit or slices[-1] == len(order) - 1:
+                    break
+                fill *= SLICE_FILL
+            unit_of_polygon[order] = next_unit + slices
+            next_unit += slices[-1] + 1
+        # a vertex on a cut is paid for by every slice using it
+        pairs = np.unique(corner_verts.astype(np.int64) * next_unit + unit_of_polygon[polygon_of_corner])
+        unit_costs = np.bincount(pairs % next_unit, weights=costs[pairs // next_unit], minlength=next_unit)
+    return unit_of_polygon, unit_costs
+
+
+def pack(items, limit):
+    ''' First fit decreasing, items are (cost, key). Returns the bins as lists of keys, the largest item is in bin 0 '''
+    bins = []
+    loads = []
+    for cost, key in sorted(items, key=lambda item: -item[0]):
+        for i, load in enumerate(loads):
+            if load + cost <= limit:
+                loads[i] += cost
+                bins[i].append(key)
+                break
+        else:
+            loads.append(cost)
+            bins.append([key])
+    return bins
+
+
+def corner_ranges(loop_starts, loop_totals):
+    ''' Corner indices of the given faces, in order '''
+    offsets = np.cumsum(loop_totals) - loop_totals
+    return np.repeat(loop_starts - offsets, loop_totals) + np.arange(loop_totals.sum(), dtype=np.intc)
+
+
+def extract_polygons(obj, polygons, name):
+    ''' A new object with only the given faces of obj, with its modifiers, shape keys, attributes and weights '''
+    mesh = obj.data
+    corner_verts, corner_edges, loop_starts, loop_totals = polygon_layout(mesh)
+    totals = loop_totals[polygons]
+    corners = corner_ranges(loop_starts[polygons], totals)
+    verts = np.unique(corner_verts[corners])
+    edges = np.unique(corner_edges[corners])
+    vert_map = np.full(len(mesh.vertices), -1, dtype=np.intc)
+    vert_map[verts] = np.arange(len(verts), dtype=np.intc)
+    edge_map = np.full(len(mesh.edges), -1, dtype=np.intc)
+    edge_map[edges] = np.arange(len(edges), dtype=np.intc)
+    edge_verts = np.empty(len(mesh.edges) * 2, dtype=np.intc)
+    mesh.edges.foreach_get("vertices", edge_verts)
+
+    new_mesh = bpy.data.meshes.new(mesh.name)
+    new_mesh.vertices.add(len(verts))
+    new_mesh.edges.add(len(edges))
+    new_mesh.loops.add(len(corners))
+    new_mesh.polygons.add(len(polygons))
+    new_mesh.edges.foreach_set("vertices", vert_map[edge_verts.reshape(-1, 2)[edges]].ravel())
+    new_mesh.loops.foreach_set("vertex_index", vert_map[corner_verts[corners]])
+    new_mesh.loops.foreach_set("edge_index", edge_map[corner_edges[corners]])
+    new_mesh.polygons.foreach_set("loop_start", (np.cumsum(totals) - totals).astype(np.intc))
+
+    # every attribute, including positions, UV maps and colours, is gathered by the indices of its domain
+    domain_indices = {'POINT': verts, 'EDGE': edges, 'FACE': polygons, 'CORNER': corners}
+    for attribute in mesh.attributes:
+        layout = ATTRIBUTE_LAYOUT.get(attribute.data_type)
+        indices = domain_indices.get(attribute.domain)
+        # names starting with "." are internal, like the UV selection layers
+        if attribute.name.startswith(".") or layout is None or indices is None:
+            continue
+        prop, dtype, components = layout
+        data = np.empty(len(attribute.data) * components, dtype=dtype)
+        attribute.data.foreach_get(prop, data)
+        new_attribute = new_mesh.attributes.get(attribute.name)
+        if new_attribute is None:
+            new_attribute = new_mesh.attributes.new(attribute.name, attribute.data_type, attribute.domain)
+        new_attribute.data.foreach_set(prop, data.reshape(-1, components)[indices].ravel())
+    new_mesh.uv_layers.active_index = mesh.uv_layers.active_index
+    if mesh.color_attributes.active_color_index >= 0:
+        new_mesh.color_attributes.active_color_index = mesh.color_attributes.active_color_index
+    if mesh.color_attributes.render_color_index >= 0:
+        new_mesh.color_attributes.render_color_index = mesh.color_attributes.render_color_index
+    for material in mesh.materials:
+        new_mesh.materials.append(material)
+    new_mesh.update()
+
+    if mesh.has_custom_normals and "custom_normal" not in mesh.attributes:
+        normals = np.empty(len(mesh.loops) * 3, dtype=np.single)
+        mesh.corner_normals.foreach_get("vector", normals)
+        new_mesh.normals_split_custom_set(normals.reshape(-1, 3)[corners])
+
+    new_obj = obj.copy()
+    new_obj.data = new_mesh
+    new_obj.name = name
+    for collection in obj.users_collection:
+        collection.objects.link(new_obj)
+
+    # one add() per distinct weight of each group, game weights only have 256 distinct values
+    group_index = []
+    for group in obj.vertex_groups:
+        new_group = new_obj.vertex_groups.get(group.name) or new_obj.vertex_groups.new(name=group.name)
+        group_index.append(new_group.index)
+    weights = vertex_weights(mesh)
+    rows = np.repeat(np.arange(len(mesh.vertices), dtype=np.intc), np.diff(weights.indptr))
+    keep = vert_map[rows] >= 0
+    rows, groups, values = vert_map[rows[keep]], weights.indices[keep], weights.data[keep]
+    order = np.lexsort((values, groups))
+    rows, groups, values = rows[order], groups[order], values[order]
+    starts = np.flatnonzero(np.diff(groups, prepend=-1) | np.diff(values, prepend=-1.0).astype(bool))
+    for start, end in zip(starts, np.append(starts[1:], len(rows))):
+        new_obj.vertex_groups[group_index[groups[start]]].add(rows[start:end].tolist(), float(values[start]), 'REPLACE')
+
+    shape_keys = mesh.shape_keys
+    if shape_keys is not None:
+        co = np.empty(len(mesh.vertices) * 3, dtype=np.single)
+        for key_block in shape_keys.key_blocks:
+            new_key = new_obj.shape_key_add(name=key_block.name, from_mix=False)
+            fast_mesh_shape_key_co_foreach_get(key_block, co)
+            fast_mesh_shape_key_co_foreach_set(new_key, co.reshape(-1, 3)[verts].ravel())
+            for prop in ("value", "mute", "slider_min", "slider_max", "vertex_group", "interpolation"):
+                setattr(new_key, prop, getattr(key_block, prop))
+        new_key_blocks = new_mesh.shape_keys.key_blocks
+        for key_block in shape_keys.key_blocks:
+            new_key_blocks[key_block.name].relative_key = new_key_blocks[key_block.relative_key.name]
+        new_mesh.shape_keys.use_relative = shape_keys.use_relative
+    return new_obj
+
+
+def split_oversize_submeshes(dupes, epsilon=0.0, union=False, limit=SUBMESH_LIMIT):
+    ''' Splits every major number over limit into as many majors as it needs, the new majors are numbered after the
+    highest one in use. Returns dupes with every broken object replaced by its pieces '''
+    groups = {}
+    for o in dupes:
+        index = submesh_index(o.name) if o.type == 'MESH' else None
+        if index is not None:
+            groups.setdefault(index[0], []).append(o)
+    next_major = max(groups, default=-1) + 1
+
+    replaced = {}
+    for major, objects in sorted(groups.items()):
+        costs = {o: vertex_costs(o, epsilon, union) for o in objects}
+        if sum(int(cost.sum()) for cost in costs.values()) <= limit:
+            continue
+
+        # objects under the limit stay whole, the others are broken into pieces
+        items = []
+        units = {}
+        names = {o: o.name for o in objects}
+        for o in objects:
+            total = int(costs[o].sum())
+            if total <= limit:
+                items.append((total, (o, None)))
+                continue
+            unit_of_polygon, unit_costs = polygon_units(o.data, costs[o], limit)
+            units[o] = unit_of_polygon
+            has_faces = np.bincount(unit_of_polygon, minlength=len(unit_costs)) > 0
+            items += [(int(unit_costs[unit]), (o, unit)) for unit in np.flatnonzero(has_faces)]
+            # frees the name for the piece that keeps it
+            o.name = names[o] + " (split)"
+        bins = pack(items, limit)
+
+        pieces = {}
+        for bin_index, keys in enumerate(bins):
+            bin_major = major if bin_index == 0 else next_major + bin_index - 1
+            # whole objects keep their minor numbers in the first bin, every other bin is numbered from 0
+            placed = {}
+            for o, unit in keys:
+                placed.setdefault(o, []).append(unit)
+            for minor, (o, piece_units) in enumerate(sorted(placed.items(), key=lambda entry: submesh_index(names[entry[0]]))):
+                if bin_index == 0:
+                    minor = submesh_index(names[o])[1]
+                name = with_submesh_index(names[o], bin_major, minor)
+                if piece_units == [None]:
+                    o.name = name
+                    continue
+                polygons = np.flatnonzero(np.isin(units[o], piece_units))
+                pieces.setdefault(o, []).append(extract_polygons(o, polygons, name))
+        next_major += len(bins) - 1
+        stats.count("submeshes_split")
+        print("split: submesh {major} split into {count} meshes".format(major=major, count=len(bins)))
+
+        for o, new_objects in pieces.items():
+            replaced[o] = new_objects
+
+    if not replaced:
+        return dupes
+    result = []
+    for o in dupes:
+        if o in replaced:
+            result += replaced[o]
+            mesh = o.data
+            bpy.data.objects.remove(o)
+            if mesh.users == 0:
+                bpy.data.meshes.remove(mesh)
+        else:
+            result.append(o)
+    return result
@@ -0,0 +1,136 @@
+import bpy
+from contextlib import contextmanager
+
+from . import stats
+
+# Export copies are staged in their own scene, so the depsgraph only has to evaluate what is being exported instead of
+# the whole working file. The leading "." keeps it out of the scene list. It is made for every export and removed with
+# the copies in it once the export is done, so it is never saved into the user's file.
+STAGING_SCENE_NAME = ".FFXIV Export Staging"
+
+# The bpy.data collections an export makes datablocks in. Shape keys belong to their meshes and go with them
+EXPORT_DATA = ("objects", "meshes", "armatures", "shape_keys")
+REMOVABLE_DATA = ("objects", "meshes", "armatures")
+
+
+class SceneIndex:
+    ''' The enabled armature modifiers of the exported meshes and the armature each one is deformed by, read in one pass
+    so nothing scans modifier stacks per lookup. Lookups keep answering while the modifiers are switched off '''
+    __slots__ = 'armature_modifiers', 'armatures'
+
+    def __init__(self, objects):
+        self.armature_modifiers = {}
+        self.armatures = {}
+        for o in objects:
+            if o.type != 'MESH':
+                continue
+            modifiers = [mod for mod in o.modifiers if mod.type == 'ARMATURE' and mod.show_viewport]
+            self.armature_modifiers[o] = modifiers
+            self.armatures[o] = next((mod.object for mod in modifiers if mod.object is not None), None)
+
+    def armature_of(self, obj):
+        return self.armatures.get(obj)
+
+    def used_armatures(self):
+        ''' Every armature a modifier points at, in order, with None if a modifier has no armature '''
+        return list(dict.fromkeys(mod.object for modifiers in self.armature_modifiers.values() for mod in modifiers))
+
+    @contextmanager
+    def armatures_disabled(self, objects, depsgraph):
+        ''' Switches the armature modifiers of objects off together with a single depsgraph update, and back on
+        together afterwards '''
+        disabled = [mod for o in objects for mod in self.armature_modifiers.get(o, ())]
+        for mod in disabled:
+            mod.show_viewport = False
+        if objects:
+            depsgraph.update()
+        try:
+            yield
+        finally:
+            for mod in disabled:
+                mod.show_viewport = True
+
+
+def new_staging_scene(context):
+    ''' Makes the staging scene with the settings exporters read copied from the current scene '''
+    # files saved while the scene was still kept between exports can have one, it would take the name
+    remove_staging_scene()
+    scene = bpy.data.scenes.new(STAGING_SCENE_NAME)
+    unit_settings = context.scene.unit_settings
+    scene.unit_settings.system = unit_settings.system
+    scene.unit_settings.scale_length = unit_settings.scale_length
+    scene.unit_settings.length_unit = unit_settings.length_unit
+    scene.frame_current = context.scene.frame_current
+    return scene
+
+
+def remove_staging_scene():
+    ''' Removes the staging scene with the export copies in it and their meshes and armatures '''
+    scene = bpy.data.scenes.get(STAGING_SCENE_NAME)
+    if scene is None:
+        return
+    objects = list(scene.collection.all_objects)
+    data = [o.data for o in objects if o.data is not None]
+    bpy.data.batch_remove(list(dict.fromkeys(objects + data)))
+    bpy.data.scenes.remove(scene)
+
+
+def _created_since(before):
+    return {name: [block for block in getattr(bpy.data, name) if block.session_uid not in before[name]]
+            for name in EXPORT_DATA}
+
+
+@contextmanager
+def export_datablocks():
+    ''' Removes every object, mesh and armature made inside, then the staging scene, once it exits, even when the export
+    fails part way.
+    Yields a dict it fills in on exit with how many datablocks of each kind the export left behind ("left"), how many of
+    those it removed ("freed") and how many were still there after that ("leaked"), which should all be 0 '''
+    # session_uid is never reused within a session, unlike the address of a datablock freed earlier
+    before = {name: {block.session_uid for block in getattr(bpy.data, name)} for name in EXPORT_DATA}
+    counts = {"left": {}, "freed": {}, "leaked": {}}
+    try:
+        yield counts
+    finally:
+        left = _created_since(before)
+        bpy.data.batch_remove([block for name in REMOVABLE_DATA for block in left[name]])
+        remove_staging_scene()
+        leaked = _created_since(before)
+        for name in EXPORT_DATA:
+            counts["left"][name] = len(left[name])
+            counts["leaked"][name] = len(leaked[name])
+            counts["freed"][name] = len(left[name]) - len(leaked[name])
+        stats.count("datablocks_freed", sum(counts["freed"].values()))
+        stats.count("datablocks_leaked", sum(counts["leaked"].values()))
+
+
+def stage_export_objects(context, objects):
+    ''' Copies the meshes and the armatures they use at the datablock level into the staging scene.
+    No operators are used so there are no view layer updates or undo pushes per object.
+    Returns the staging scene and the copies, or None, None if an armature modifier has no armature '''
+    meshes = [o for o in objects if o.type == 'MESH']
+    armatures = SceneIndex(meshes).used_armatures()
+    if None in armatures:
+        return None, None
+
+    scene = new_staging_scene(context)
+
+    copies = {}
+    for o in meshes + armatures:
+        dupe = o.copy()
+        dupe.data = o.data.copy()
+        dupe.name = "Export " + o.name
+        # the originals can be hidden or excluded, the copies always have to be visible
+        dupe.hide_viewport = False
+        dupe.hide_select = False
+        scene.collection.objects.link(dupe)
+        copies[o] = dupe
+
+    for dupe in copies.values():
+        if dupe.parent in copies:
+            dupe.parent = copies[dupe.parent]
+        for mod in (mod for mod in dupe.modifiers if mod.type == 'ARMATURE'):
+            if mod.object in copies:
+                mod.object = copies[mod.object]
+
+    return scene, list(copies.values())
@@ -0,0 +1,119 @@
+import bpy
+import json
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Stats of the export being recorded, None outside of recording() so the helpers cost nothing otherwise
+current = None
+
+
+class ExportStats:
+    ''' Seconds spent in each stage, counters of the work done and peak memory per object during one export '''
+    __slots__ = 'stages', 'counters', 'memory', 'start', 'datablock_peak', 'trace_memory'
+
+    def __init__(self, trace_memory=False):
+        # insertion ordered, so stages are listed in the order they first ran
+        self.stages = {}
+        self.counters = {}
+        self.memory = {}
+        self.start = time.perf_counter()
+        # most meshes and objects alive at once inside tracking_memory, None outside of it
+        self.datablock_peak = None
+        # tracemalloc slows every Python allocation down, so it only runs when asked for
+        self.trace_memory = trace_memory
+
+    def to_dict(self):
+        return {
+            "seconds": time.perf_counter() - self.start,
+            "stages": dict(self.stages),
+            "counters": dict(self.counters),
+            "memory": dict(self.memory),
+        }
+
+    def summary(self):
+        ''' One line for the operator report '''
+        stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+        counters = ", ".join(f"{name} {value}" for name, value in self.counters.items())
+        line = f"Exported in {time.perf_counter() - self.start:.2f}s ({stages}); {counters}"
+        if self.trace_memory and self.memory:
+            name, memory = max(self.memory.items(), key=lambda item: item[1]["peak_bytes"])
+            line += f"; peak {memory['peak_bytes'] / 2**20:.1f}MB in {name}"
+        return line
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+@contextmanager
+def recording(trace_memory=False):
+    ''' Records the stages and counters of everything run inside, yields the ExportStats.
+    With trace_memory tracking_memory also records peak Python memory '''
+    global current
+    previous = current
+    current = ExportStats(trace_memory)
+    try:
+        yield current
+    finally:
+        current = previous
+
+
+@contextmanager
+def stage(name):
+    ''' Adds the time spent inside to the named stage, stages entered more than once add up '''
+    if current is None:
+        yield
+        return
+    recorded = current
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorded.stages[name] = recorded.stages.get(name, 0.0) + time.perf_counter() - start
+
+
+def count(name, amount=1):
+    if current is not None:
+        current.counters[name] = current.counters.get(name, 0) + amount
+
+
+def _datablock_count():
+    return len(bpy.data.meshes) + len(bpy.data.objects)
+
+
+@contextmanager
+def tracking_memory(name):
+    ''' Records under name the most meshes and objects alive at once above what there was before, how many of those
+    are left afterwards and, when recording with trace_memory, the peak memory allocated from Python inside (numpy
+    arrays included). Blender's own allocations aren't visible to tracemalloc, the datablock counts stand in for them '''
+    if current is None:
+        yield
+        return
+    recorded = current
+    started = recorded.trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    if recorded.trace_memory:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+    datablocks = recorded.datablock_peak = _datablock_count()
+    try:
+        yield
+    finally:
+        peak = tracemalloc.get_traced_memory()[1] - baseline if recorded.trace_memory else None
+        if started:
+            tracemalloc.stop()
+        sample_datablocks()
+        recorded.memory[name] = {
+            "peak_bytes": peak,
+            "peak_datablocks": recorded.datablock_peak - datablocks,
+            "datablocks_left": _datablock_count() - datablocks,
+        }
+        recorded.datablock_peak = None
+
+
+def sample_datablocks():
+    ''' Call where temporary meshes or objects are alive, inside tracking_memory it keeps the most seen at once '''
+    if current is not None and current.datablock_peak is not None:
+        current.datablock_peak = max(current.datablock_peak, _datablock_count())
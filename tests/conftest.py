@@ -0,0 +1,32 @@
+'''
+Fixtures for the tests that need the bpy module. It is imported only when one of them is used, so the tests that
+don't need Blender still run without it.
+'''
+
+import importlib.util
+import os
+
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_module(name):
+    ''' Imports one of the add-on's standalone modules on its own, outside the add-on package '''
+    spec = importlib.util.spec_from_file_location(name, os.path.join(PACKAGE_DIR, name + ".py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fixture_scene():
+    ''' A new empty file with the add-on registered and one benchmark fixture, yields the add-on, the mesh object and
+    the armature object '''
+    bpy = pytest.importorskip("bpy")
+    bpy.ops.wm.read_homefile(use_empty=True)
+    addon = load_module("addon_loader").load_addon()
+    benchmark = load_module("benchmark")
+    obj, arm_obj = benchmark.make_fixture(1024, 6, 2)
+    yield addon, obj, arm_obj
+    benchmark.clear_scene()
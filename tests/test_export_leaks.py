@@ -0,0 +1,37 @@
+'''
+Every datablock an export makes has to be gone afterwards, whether the export finished or failed.
+Needs the bpy module, or run inside Blender: blender -b --factory-startup --python-expr "import pytest; pytest.main()"
+'''
+
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+EXPORT_DATA = ("objects", "meshes", "armatures", "shape_keys")
+
+
+def datablock_counts():
+    return {name: len(getattr(bpy.data, name)) for name in EXPORT_DATA}
+
+
+@pytest.mark.parametrize("filename_ext", ['.glb', '.mdl'])
+def test_export_frees_everything(fixture_scene, tmp_path, filename_ext):
+    addon, obj, _ = fixture_scene
+    before = datablock_counts()
+    result = bpy.ops.export_scene.tool(filepath=str(tmp_path / ("body" + filename_ext)), filename_ext=filename_ext,
+                                       use_cache=False)
+    assert result == {'FINISHED'}
+    assert datablock_counts() == before
+    assert addon.staging.STAGING_SCENE_NAME not in bpy.data.scenes
+
+
+def test_failed_export_frees_everything(fixture_scene):
+    addon, obj, _ = fixture_scene
+    before = datablock_counts()
+    with pytest.raises(RuntimeError):
+        with addon.staging.export_datablocks() as datablocks:
+            addon.staging.stage_export_objects(bpy.context, [obj])
+            raise RuntimeError("export failed part way")
+    assert datablocks["leaked"] == {name: 0 for name in EXPORT_DATA}
+    assert datablocks["freed"]["objects"] == 2 and datablocks["freed"]["meshes"] == 1
+    assert datablock_counts() == before
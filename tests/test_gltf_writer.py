@@ -0,0 +1,60 @@
+'''
+The native glTF writer has to give Penumbra what the stock exporter gives it: the same attributes, vertex and index
+counts, morph targets and custom properties for the same staged fixture.
+Needs the bpy module, or run inside Blender: blender -b --factory-startup --python-expr "import pytest; pytest.main()"
+'''
+
+import json
+import struct
+
+import numpy as np
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+
+def read_glb_json(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    json_length, = struct.unpack_from("<I", data, 12)
+    return json.loads(data[20:20 + json_length])
+
+
+def mesh_summary(gltf, name):
+    ''' What Penumbra reads of the node and mesh of the staged copy called name '''
+    node = next(node for node in gltf["nodes"] if node["name"] == name)
+    mesh = gltf["meshes"][node["mesh"]]
+    accessors = gltf["accessors"]
+    primitive = mesh["primitives"][0]
+    position = accessors[primitive["attributes"]["POSITION"]]
+    return {
+        "attributes": sorted(primitive["attributes"]),
+        "verts": position["count"],
+        "min": position["min"],
+        "max": position["max"],
+        "indices": sum(accessors[primitive["indices"]]["count"] for primitive in mesh["primitives"]),
+        "targets": [sorted(target) for target in primitive.get("targets", ())],
+        "target_names": mesh.get("extras", {}).get("targetNames", []),
+        "joints": len(gltf["skins"][node["skin"]]["joints"]) if "skin" in node else 0,
+        "extras": node.get("extras", {}),
+    }
+
+
+@pytest.mark.parametrize("gltf_props", [True, False])
+def test_native_writer_matches_stock_exporter(fixture_scene, tmp_path, gltf_props):
+    _, obj, _ = fixture_scene
+    obj["test_prop"] = 1
+    summaries = []
+    for use_native_gltf in (True, False):
+        filepath = tmp_path / ("native.glb" if use_native_gltf else "stock.glb")
+        result = bpy.ops.export_scene.tool(filepath=str(filepath), filename_ext='.glb', use_cache=False,
+                                           use_native_gltf=use_native_gltf, gltf_props=gltf_props)
+        assert result == {'FINISHED'}
+        summaries.append(mesh_summary(read_glb_json(filepath), "Export " + obj.name))
+    native, stock = summaries
+
+    for key in ("attributes", "verts", "indices", "targets", "target_names", "joints"):
+        assert native[key] == stock[key], key
+    np.testing.assert_allclose(native["min"], stock["min"], atol=1e-5)
+    np.testing.assert_allclose(native["max"], stock["max"], atol=1e-5)
+    assert native["extras"] == stock["extras"] == ({"test_prop": 1} if gltf_props else {})
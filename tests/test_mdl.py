@@ -0,0 +1,38 @@
+'''
+Reading Blender meshes into what pack_mdl takes.
+Needs the bpy module, or run inside Blender: blender -b --factory-startup --python-expr "import pytest; pytest.main()"
+'''
+
+import numpy as np
+import pytest
+
+bpy = pytest.importorskip("bpy")
+
+
+def test_collect_skinned_mesh(fixture_scene):
+    addon, obj, arm_obj = fixture_scene
+    meshes, bone_names = addon.mdl.collect_meshes(bpy.context, [obj, arm_obj], use_cache=False)
+
+    [mesh] = meshes
+    [sub] = mesh["submeshes"]
+    assert len(sub["positions"]) >= len(obj.data.vertices)
+    # every vertex of the fixture is weighted to the bone of its band, all of them are used
+    assert bone_names == [bone.name for bone in arm_obj.data.bones]
+    assert sub["joints"] is not None
+    assert sub["joints"].max() < len(bone_names)
+
+
+def test_byte_colors_are_written_as_stored(fixture_scene):
+    addon, obj, arm_obj = fixture_scene
+    mesh = obj.data
+    color_attribute = mesh.color_attributes.new("Mask", 'BYTE_COLOR', 'POINT')
+    mesh.color_attributes.render_color_index = mesh.color_attributes.find("Mask")
+    stored = (np.arange(len(mesh.vertices) * 4) % 256).astype(np.uint8).reshape(-1, 4)
+    color_attribute.data.foreach_set("color_srgb", (stored / np.single(255.0)).ravel())
+
+    meshes, bone_names = addon.mdl.collect_meshes(bpy.context, [obj, arm_obj], use_cache=False)
+    model = addon.mdl_format.read_mdl(addon.mdl_format.pack_mdl(meshes, bone_names))
+
+    [written] = model["meshes"]
+    vertex_count = len(meshes[0]["submeshes"][0]["positions"])
+    assert {tuple(color) for color in written["colors"][:vertex_count]} == {tuple(color) for color in stored}
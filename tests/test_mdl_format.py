@@ -0,0 +1,86 @@
+'''
+Round trip of pack_mdl through read_mdl. mdl_format.py doesn't need Blender, so it is loaded on its own instead of
+through the add-on package.
+'''
+
+import importlib.util
+import os
+
+import numpy as np
+import pytest
+
+spec = importlib.util.spec_from_file_location(
+    "mdl_format", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mdl_format.py"))
+mdl_format = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(mdl_format)
+
+
+def quad_submesh(offset, joint, attributes=(), shapes=()):
+    ''' Two triangles in game space, every vertex weighted fully to joint '''
+    positions = np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [1.0, 1.0, 0.0], [0.0, 1.0, 0.0]], dtype=np.single)
+    positions[:, 0] += offset
+    return {
+        "positions": positions,
+        "normals": np.tile(np.array([0.0, 0.0, 1.0], dtype=np.single), (4, 1)),
+        "tangents": np.tile(np.array([1.0, 0.0, 0.0, 1.0], dtype=np.single), (4, 1)),
+        "uvs": [positions[:, :2].copy()],
+        "color": np.ones((4, 4), dtype=np.single),
+        "joints": np.array([[joint, 0, 0, 0]] * 4, dtype=np.intc),
+        "weights": np.array([[1.0, 0.0, 0.0, 0.0]] * 4, dtype=np.single),
+        "triangles": np.array([[0, 1, 2], [0, 2, 3]], dtype=np.intc),
+        "attributes": list(attributes),
+        "shapes": list(shapes),
+    }
+
+
+def test_round_trip():
+    offsets = np.zeros((4, 3), dtype=np.single)
+    offsets[2, 1] = 0.25
+    shape = ("shp_test", offsets, np.zeros((4, 3), dtype=np.single))
+    body = [quad_submesh(0.0, 0, attributes=["atr_a"], shapes=[shape]), quad_submesh(2.0, 1)]
+    # vertex colours are shader masks, every byte has to come back as it was
+    color_bytes = np.arange(16, dtype=np.uint8).reshape(4, 4) * 17
+    body[0]["color"] = color_bytes / np.single(255.0)
+    hands = [quad_submesh(5.0, 1)]
+    meshes = [{"material": "/mt_body.mtrl", "submeshes": body}, {"material": "/mt_hands.mtrl", "submeshes": hands}]
+    bone_names = ["j_kosi", "j_sebo_a"]
+
+    model = mdl_format.read_mdl(mdl_format.pack_mdl(meshes, bone_names))
+
+    assert model["materials"] == ["/mt_body.mtrl", "/mt_hands.mtrl"]
+    assert model["bones"] == bone_names
+    assert model["attributes"] == ["atr_a"]
+    body_mesh, hands_mesh = model["meshes"]
+    assert body_mesh["bone_table"] == bone_names
+    assert hands_mesh["bone_table"] == ["j_sebo_a"]
+
+    # the shape's moved vertex is appended after the submeshes' vertices
+    expected = np.concatenate([sub["positions"] for sub in body])
+    np.testing.assert_array_equal(body_mesh["positions"][:len(expected)], expected)
+    np.testing.assert_array_equal(hands_mesh["positions"], hands[0]["positions"])
+    np.testing.assert_array_equal(body_mesh["colors"][:4], color_bytes)
+
+    first, second = body_mesh["submeshes"]
+    np.testing.assert_array_equal(first["indices"], body[0]["triangles"].reshape(-1))
+    np.testing.assert_array_equal(second["indices"], body[1]["triangles"].reshape(-1) + 4)
+    assert first["attributes"] == ["atr_a"] and second["attributes"] == []
+    np.testing.assert_array_equal(hands_mesh["indices"], hands[0]["triangles"].reshape(-1))
+
+    # vertex 2 is used by both triangles of the first submesh, each use is replaced by the moved copy
+    [(start, values)] = model["shapes"]["shp_test"]
+    assert start == 0
+    mesh_indices = body_mesh["indices"]
+    assert sorted(mesh_indices[values["base_index"]]) == [2, 2]
+    for replacing in values["replacing_vertex"]:
+        np.testing.assert_allclose(body_mesh["positions"][replacing], expected[2] + offsets[2])
+
+
+def test_too_many_vertices():
+    sub = quad_submesh(0.0, 0)
+    count = mdl_format.MAX_MESH_VERTICES + 1
+    sub.update(positions=np.zeros((count, 3), dtype=np.single), normals=np.zeros((count, 3), dtype=np.single),
+               tangents=np.zeros((count, 4), dtype=np.single), uvs=[np.zeros((count, 2), dtype=np.single)],
+               color=np.ones((count, 4), dtype=np.single), joints=np.zeros((count, 4), dtype=np.intc),
+               weights=np.zeros((count, 4), dtype=np.single))
+    with pytest.raises(ValueError):
+        mdl_format.pack_mdl([{"material": "/mt_body.mtrl", "submeshes": [sub]}], ["j_kosi"])
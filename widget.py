@@ -4,20 +4,38 @@ from bpy.app.handlers import persistent
 from gpu_extras.batch import batch_for_shader
 import mathutils
 import re
+import time
+import numpy as np
+from .staging import STAGING_SCENE_NAME
+from .functions import exported_vertex_sources, fast_mesh_shape_key_co_foreach_get, SparseDelta
 
 
 
-shader = gpu.shader.from_builtin('SMOOTH_COLOR')
-shader_box = gpu.shader.from_builtin('UNIFORM_COLOR')
+# gpu drawing isn't available under blender -b, the overlay is never drawn there
+if not bpy.app.background:
+    shader = gpu.shader.from_builtin('SMOOTH_COLOR')
+    shader_box = gpu.shader.from_builtin('UNIFORM_COLOR')
+else:
+    shader = shader_box = None
 
 owner = object()
 
+# epsilon: coordinate differences up to this are float noise and don't count as moved
+# union: count each vertex moved by any shp key once, instead of once per key
+# split: count the vertices the exporter writes, seams and sharp edges split a vertex into several
+settings = {
+    "epsilon": 0.0,
+    "union": False,
+    "split": True,
+}
+
 
 
 
 
 def msgbus_callback(*args):
-    calc(args[0])
+    # renamed objects miss the cache by name and get recounted on the next draw, the rest is reused
+    tag_redraw()
 
 def subscribe():
 
@@ -33,6 +51,8 @@ def subscribe():
     )
     if load_handler not in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.append(load_handler)
+    if depsgraph_handler not in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.append(depsgraph_handler)
     
 
 def unsubscribe():
@@ -44,10 +64,19 @@ def unsubscribe():
     # Unregister the persistent handler.
     if load_handler in bpy.app.handlers.load_post:
         bpy.app.handlers.load_post.remove(load_handler)
+    if depsgraph_handler in bpy.app.handlers.depsgraph_update_post:
+        bpy.app.handlers.depsgraph_update_post.remove(depsgraph_handler)
+    if bpy.app.timers.is_registered(recount_timer):
+        bpy.app.timers.unregister(recount_timer)
 
 
 @persistent
 def load_handler(dummy):
+    global current_job
+    # a new file can reuse the old object names, so nothing half counted or queued from the old one carries over
+    invalidate()
+    current_job = None
+    pending.clear()
     subscribe()
 
 class BlfText:
@@ -81,7 +110,7 @@ class BlfText:
 
 def draw_element(pos_left=0, pos_bottom=0, scale=1.0, bar_size_x=250, bar_size_y=20):
 
-    counter = calc()
+    counter, recounting = calc_cached()
 
     border = round(10 * scale)
     inner = round(8 * scale)
@@ -100,11 +129,12 @@ def draw_element(pos_left=0, pos_bottom=0, scale=1.0, bar_size_x=250, bar_size_y
     string = ""
     warning = ""
     if bpy.context.active_object != None and bpy.context.active_object.type == 'MESH':
-        matching = re.search(r"(?P<major>\d{1,2})\.(?P<minor>\d{1,5})", bpy.context.active_object.name)
+        major = submesh_major(bpy.context.active_object.name)
 
-        if matching != None:
-            major = int(matching.groupdict()['major'])
-            string = "The active submesh {major} is using {val} verts towards the limit\n".format(val=counter[major], major=major)
+        if major != None:
+            string = "The active submesh {major} is using {val} verts towards the limit\n".format(val=counter.get(major, 0), major=major)
+    if recounting:
+        string += "(recounting...)"
 
 
     for key in counter.keys():
@@ -139,40 +169,220 @@ def draw_widget():
 
 
 
-def calc(override=False):
-    if not hasattr(calc, "counter"):
-        calc.counter = dict()
-    if not hasattr(calc, "objs_seen"):
-        calc.objs_seen = 0
+# object name -> (mesh name, submesh major or None, vertex count including shapekeys)
+# entries are dropped by depsgraph_handler when the object's geometry changes
+object_costs = dict()
 
-    current_objs = 0
-    for o in (o for o in bpy.context.scene.objects if o.type == 'MESH' and o.visible_get()):
-        current_objs += 1
-    
-    if(current_objs == calc.objs_seen and not override):
-        return calc.counter
+
+def is_cached(o):
+    entry = object_costs.get(o.name)
+    return entry is not None and entry[0] == o.data.name
+
+
+def submesh_major(name):
+    matching = re.search(r"(?P<major>\d{1,2})\.(?P<minor>\d{1,5})", name)
+    if matching != None:
+        return int(matching.groupdict()['major'])
+    return None
+
+
+def count_object_steps(o, epsilon=0.0, union=False, split=False):
+    ''' Counts the verts of o including shapekeys, yielding the running count after the base verts and every shapekey '''
+    multiplicity = None
+    if split:
+        sources = exported_vertex_sources(o.data)
+        # how many exported verts each vertex turns into
+        multiplicity = np.bincount(sources, minlength=len(o.data.vertices))
+        cost = len(sources)
     else:
-        calc.objs_seen = 0
-        calc.counter = dict()
+        cost = len(o.data.vertices)
+    yield cost
+    if(o.data.shape_keys != None):
+        for shape_verts in count_shape_key_verts_steps(o, epsilon, union, multiplicity):
+            yield cost + shape_verts
+
+
+def count_object(o, epsilon=0.0, union=False, split=False):
+    cost = 0
+    for cost in count_object_steps(o, epsilon, union, split):
+        pass
+    return cost
+
+
+def object_cost_steps(o):
+    ''' Counts o one step at a time, yielding in between, and stores the result in object_costs '''
+    name = o.name
+    mesh_name = o.data.name
+    major = submesh_major(name)
+    cost = 0
+    if major is not None:
+        for cost in count_object_steps(o, settings["epsilon"], settings["union"], settings["split"]):
+            yield
+    object_costs[name] = (mesh_name, major, cost)
+
+
+def object_cost(o):
+    if not is_cached(o):
+        for _ in object_cost_steps(o):
+            pass
+    return object_costs[o.name]
+
+
+def update_settings(epsilon, union, split):
+    ''' Counts with new settings from now on, every cost counted with the old ones is forgotten '''
+    global current_job
+    settings.update(epsilon=epsilon, union=union, split=split)
+    invalidate()
+    if current_job is not None:
+        pending.add(current_job[0])
+        current_job = None
+    tag_redraw()
+
+
+def invalidate(names=None):
+    ''' Forget the cached costs of the named objects, or of every object '''
+    if names is None:
+        object_costs.clear()
+    else:
+        for name in names:
+            object_costs.pop(name, None)
+
+
+@persistent
+def depsgraph_handler(scene, depsgraph):
+    # export copies aren't shown by the overlay
+    if scene.name == STAGING_SCENE_NAME:
+        return
+    dirty_meshes = set()
+    for update in depsgraph.updates:
+        datablock = update.id.original
+        if isinstance(datablock, bpy.types.Object):
+            if update.is_updated_geometry:
+                object_costs.pop(datablock.name, None)
+        elif isinstance(datablock, bpy.types.Mesh):
+            dirty_meshes.add(datablock.name)
+        elif isinstance(datablock, bpy.types.Key) and datablock.user is not None:
+            dirty_meshes.add(datablock.user.name)
+    if dirty_meshes:
+        invalidate([name for name, entry in object_costs.items() if entry[0] in dirty_meshes])
+    # the object being counted may have just changed, so start it over
+    global current_job
+    if current_job is not None and current_job[0] not in object_costs:
+        pending.add(current_job[0])
+        current_job = None
+
+
+# time the recount timer may spend per tick, in seconds
+RECOUNT_BUDGET = 0.005
+
+# names of visible objects missing from object_costs, counted by recount_timer
+pending = set()
+# (object name, object_cost_steps generator) of the object the timer is part way through
+current_job = None
+# the last counter calc_cached returned while nothing was pending
+last_counter = dict()
+
+
+def tag_redraw():
+    for window in bpy.context.window_manager.windows:
+        for area in window.screen.areas:
+            if area.type == 'VIEW_3D':
+                area.tag_redraw()
+
+
+def recount_timer():
+    ''' Counts pending objects until RECOUNT_BUDGET runs out, then waits for the next tick '''
+    global current_job
+    start = time.perf_counter()
+    while time.perf_counter() - start < RECOUNT_BUDGET:
+        if current_job is None:
+            if not pending:
+                tag_redraw()
+                return None
+            name = pending.pop()
+            o = bpy.data.objects.get(name)
+            if o is None or o.type != 'MESH' or is_cached(o):
+                continue
+            current_job = (name, object_cost_steps(o))
+        try:
+            next(current_job[1])
+        except StopIteration:
+            current_job = None
+        except ReferenceError:
+            # removed part way through
+            current_job = None
+    return 0.0
+
+
+def calc_cached():
+    ''' Counter for the draw handler, only adds up cached costs and hands the rest to recount_timer.
+    Returns the last finished counter and whether a recount is running '''
+    global last_counter
+    counter = dict()
+    for o in (o for o in bpy.context.scene.objects if o.type == 'MESH' and o.visible_get()):
+        if not is_cached(o):
+            if current_job is None or current_job[0] != o.name:
+                pending.add(o.name)
+            continue
+        mesh_name, major, cost = object_costs[o.name]
+        if major is not None:
+            counter[major] = counter.get(major, 0) + cost
+
+    if pending or current_job is not None:
+        if not bpy.app.timers.is_registered(recount_timer):
+            bpy.app.timers.register(recount_timer, first_interval=0.0)
+        return last_counter, True
+    last_counter = counter
+    return counter, False
+
+
+def calc(override=False):
+    if override:
+        invalidate()
 
+    counter = dict()
     for o in (o for o in bpy.context.scene.objects if o.type == 'MESH' and o.visible_get()):
-        calc.objs_seen += 1
-        matching = re.search(r"(?P<major>\d{1,2})\.(?P<minor>\d{1,5})", o.name)
-        if matching != None:
-            #check keys
-            major = int(matching.groupdict()['major'])
-            minor = int(matching.groupdict()['minor'])
-            if major not in calc.counter.keys():
-                calc.counter[major] = 0
-            if(o.data.shape_keys != None):
-                shape_verts = 0  
-                for shp in (shp for shp in o.data.shape_keys.key_blocks if shp != o.data.shape_keys.reference_key and 'shp' in shp.name.lower()):
-                    for key in shp.points.items():
-                        if shp.points[key[0]].co != o.data.shape_keys.reference_key.points[key[0]].co: 
-                            shape_verts = shape_verts + 1 
-                                
-                calc.counter[major] += shape_verts       
-            calc.counter[major] += len(o.data.vertices.items())
-    return calc.counter
+        mesh_name, major, cost = object_cost(o)
+        if major is not None:
+            counter[major] = counter.get(major, 0) + cost
+    return counter
+
+
+def count_shape_key_verts_steps(o, epsilon=0.0, union=False, multiplicity=None):
+    ''' Counts the vertices each shp key moves away from the reference key.
+    Yields the running count after every key, the last value is the total.
+    With union a vertex moved by several keys is only counted once.
+    multiplicity is the number of exported verts per vertex, a moved vertex costs all of them '''
+    shape_keys = o.data.shape_keys
+    reference_key = shape_keys.reference_key
+    num_verts = len(o.data.vertices)
+
+    reference_co = np.empty(num_verts * 3, dtype=np.single)
+    co = np.empty(num_verts * 3, dtype=np.single)
+    fast_mesh_shape_key_co_foreach_get(reference_key, reference_co)
+
+    def cost(moved_indices):
+        if multiplicity is None:
+            return len(moved_indices)
+        return int(multiplicity[moved_indices].sum())
+
+    affected = np.empty(0, dtype=np.intc)
+    shape_verts = 0
+    yield shape_verts
+    for shp in (shp for shp in shape_keys.key_blocks if shp != reference_key and 'shp' in shp.name.lower()):
+        moved = SparseDelta.from_shape_key(shp, reference_co, epsilon, temp_co_array=co)
+        if union:
+            affected = np.union1d(affected, moved.indices)
+            shape_verts = cost(affected)
+        else:
+            shape_verts += cost(moved.indices)
+        yield shape_verts
+
+
+def count_shape_key_verts(o, epsilon=0.0, union=False, multiplicity=None):
+    shape_verts = 0
+    for shape_verts in count_shape_key_verts_steps(o, epsilon, union, multiplicity):
+        pass
+    return shape_verts
 
 # Add the draw handler